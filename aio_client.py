@@ -0,0 +1,152 @@
+"""
+asyncio client of the Deep Audio API, built on grpc.aio
+Usage:
+    async with AsyncClient(url, token, username) as client:
+        responses, durations, dict_responses = await client.predict_files(models, files)
+"""
+
+from __future__ import print_function
+import asyncio
+import grpc
+import magcil_api_pb2
+import magcil_api_pb2_grpc
+import client
+from audio_io import decode_file, iter_chunks
+from cache import merge_replies
+
+
+class AsyncClient:
+    """Owns one grpc.aio channel. Every predict call opens its own Predict
+    stream on it, so many calls can run concurrently on one event loop."""
+    def __init__(self, url, token, username, root_certificates=None,
+                 private_key=None, certificate_chain=None):
+        self.url = url
+        self.token = token
+        self.username = username
+        self.certificates = (root_certificates, private_key, certificate_chain)
+        self.channel = None
+        self.stub = None
+
+    async def __aenter__(self):
+        self.channel = grpc.aio.secure_channel(self.url, client.channel_credentials(
+            self.token, self.username, *self.certificates))
+        try:
+            await asyncio.wait_for(self.channel.channel_ready(), timeout=3)
+        except asyncio.TimeoutError:
+            await self.channel.close()
+            raise ConnectionError(f"Error connecting to server {self.url}")
+        self.stub = magcil_api_pb2_grpc.AudioModelsPredictStub(self.channel)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.channel.close()
+
+    async def predict_stream(self, requests):
+        """Yields the MagCilReply of every AudioRequest in requests, which may
+        be a regular or an async iterable."""
+        call = self.stub.Predict(requests)
+        try:
+            async for response in call:
+                yield response
+        finally:
+            call.cancel()
+
+    async def predict_files(self, models, list_of_files, model_version="",
+                            max_in_flight=2, chunk_duration=None,
+                            verbose=False, columnar=False, cache=None):
+        """Async counterpart of client.run().
+
+        Files are decoded, and cache lookups and updates run, in the default
+        executor, so the event loop is never blocked, and at most
+        max_in_flight requests wait for replies.
+        With a cache.PredictionCache, requests only ask for the models
+        missing from it, and are not sent at all if every model is cached.
+        An error raised while decoding or looking up requests ends the
+        stream and is re-raised here.
+        """
+        slots = asyncio.Semaphore(max_in_flight)
+        filenames = []
+        durations = []
+        pending = {}
+        errors = []
+        collector = client.ReplyCollector(chunk_duration, verbose=verbose,
+                                          columnar=columnar)
+        requests = self._requests(models, list_of_files, model_version, slots,
+                                  filenames, durations, chunk_duration, cache,
+                                  pending, collector, errors)
+        loop = asyncio.get_running_loop()
+        try:
+            async for response in self.predict_stream(requests):
+                slots.release()
+                if cache is not None and pending.get(response.filename):
+                    audio, parts = pending[response.filename].pop(0)
+                    response = await loop.run_in_executor(
+                        None, cache.complete, audio, models, parts, response, model_version)
+                collector.add(response)
+        except (grpc.RpcError, asyncio.CancelledError):
+            # grpc.aio cancels the call when the request iterator raises
+            if errors:
+                raise errors[0]
+            raise
+        if errors:
+            raise errors[0]
+        collector.finish(filenames)
+        return collector.responses, durations, collector.dict_responses
+
+    async def _requests(self, models, list_of_files, model_version, slots,
+                        filenames, durations, chunk_duration, cache, pending,
+                        collector, errors):
+        loop = asyncio.get_running_loop()
+        decoded = self._decoded(list_of_files, filenames, durations, chunk_duration)
+        try:
+            async for filename, data, dimension, fs in decoded:
+                missing = models
+                if cache is not None:
+                    # hashing the payload and querying SQLite would block the loop
+                    audio, parts, missing = await loop.run_in_executor(
+                        None, cache.lookup, data, fs, models, model_version)
+                    if not missing:
+                        collector.add(merge_replies(filename, models, parts))
+                        continue
+                    pending.setdefault(filename, []).append((audio, parts))
+                await slots.acquire()
+                yield magcil_api_pb2.AudioRequest(
+                    filename=filename, dimension=dimension,
+                    data=data, fs=fs, models=missing,
+                    model_version=model_version)
+        except Exception as e:
+            errors.append(e)
+
+    async def _decoded(self, list_of_files, filenames, durations, chunk_duration):
+        loop = asyncio.get_running_loop()
+        for filename in list_of_files:
+            if chunk_duration:
+                chunks = iter_chunks(filename, chunk_duration)
+                index = 0
+                duration = 0.0
+                while True:
+                    chunk = await loop.run_in_executor(None, next, chunks, None)
+                    if chunk is None:
+                        break
+                    data, dimension, fs = chunk
+                    duration += dimension[0] / float(fs)
+                    yield f"{filename}{client.CHUNK_SEPARATOR}{index}", data, dimension, fs
+                    index += 1
+                filenames.append(filename)
+                durations.append(duration)
+            else:
+                _, data, dimension, fs, duration = await loop.run_in_executor(
+                    None, decode_file, filename, 8000)
+                filenames.append(filename)
+                durations.append(duration)
+                yield filename, data, dimension, fs
+
+
+async def predict_files(models, list_of_files, token, username, model_version="",
+                        url='localhost:50051', root_certificates=None, private_key=None,
+                        certificate_chain=None, **kwargs):
+    """Opens a channel, runs AsyncClient.predict_files() on it and closes it."""
+    async with AsyncClient(url, token, username, root_certificates, private_key,
+                           certificate_chain) as aio_client:
+        return await aio_client.predict_files(models, list_of_files, model_version,
+                                              **kwargs)
@@ -0,0 +1,183 @@
+"Audio decoding helpers that turn input files into int16 payloads for AudioRequests"
+import collections
+import contextlib
+import multiprocessing
+import queue
+import threading
+import wave
+from concurrent import futures
+
+
+def get_wav_duration(fname):
+    with contextlib.closing(wave.open(fname,'r')) as f:
+        frames = f.getnframes()
+        rate = f.getframerate()
+        duration = frames / float(rate)
+        return duration
+
+
+def read_pcm(filename, sr=8000):
+    """Returns the PCM frames of a WAV file that is already `sr` Hz mono int16.
+
+    Returns None for any other input, which then has to be decoded and
+    resampled by librosa.
+    """
+    try:
+        f = wave.open(filename, 'rb')
+    except (wave.Error, EOFError):
+        return None
+    with contextlib.closing(f):
+        if (f.getnchannels(), f.getsampwidth(), f.getframerate(),
+                f.getcomptype()) != (1, 2, sr, 'NONE'):
+            return None
+        return f.readframes(f.getnframes())
+
+
+def decode_file(filename, sr=8000):
+    """Decodes one file into a ready-to-send int16 buffer.
+
+    Returns a (filename, data, dimension, fs, duration) tuple, so results
+    can be matched to their files even when produced out of order. The
+    duration (in seconds) is the number of decoded samples divided by fs,
+    so the file is only opened once, whatever its format.
+    """
+    data = read_pcm(filename, sr)
+    if data is not None:
+        # already in the format the server expects, skip the float round-trip
+        n_samples = len(data) // 2
+        return filename, data, (n_samples,), sr, n_samples / float(sr)
+    import librosa
+    x, fs = librosa.load(filename, sr=sr, mono=True)
+    dimension = x.shape
+    x = (x * (2 ** 15)).astype('int16')
+    return filename, x.tobytes(), dimension, fs, x.shape[0] / float(fs)
+
+
+def iter_chunks(filename, chunk_duration, sr=8000):
+    """Yields consecutive (data, dimension, fs) chunks of chunk_duration seconds.
+
+    Only one chunk is held in memory at a time. 8 kHz mono int16 WAV files
+    are read frame by frame, anything else is decoded chunk by chunk with
+    librosa.
+    """
+    chunk_samples = int(chunk_duration * sr)
+    try:
+        f = wave.open(filename, 'rb')
+    except (wave.Error, EOFError):
+        f = None
+    if f is not None:
+        with contextlib.closing(f):
+            if (f.getnchannels(), f.getsampwidth(), f.getframerate(),
+                    f.getcomptype()) == (1, 2, sr, 'NONE'):
+                while True:
+                    data = f.readframes(chunk_samples)
+                    if not data:
+                        return
+                    yield data, (len(data) // 2,), sr
+
+    import librosa
+    offset = 0
+    while True:
+        x, fs = librosa.load(filename, sr=sr, mono=True,
+                             offset=offset, duration=chunk_duration)
+        if x.size == 0:
+            return
+        dimension = x.shape
+        x = (x * (2 ** 15)).astype('int16')
+        yield x.tobytes(), dimension, fs
+        if x.size < chunk_samples:
+            return
+        offset += chunk_duration
+
+
+def iter_decoded(list_of_files, workers=1, ordered=True, on_error=None):
+    """Yields decode_file() results for every file in list_of_files.
+
+    With workers > 1 files are decoded by a process pool, keeping at most
+    `workers` files decoding ahead of the consumer. If ordered is False,
+    results are yielded as soon as they are ready instead of in input order.
+    If on_error is given, a file that cannot be decoded is passed to
+    on_error(filename, exception) and skipped instead of raising.
+    """
+    if workers <= 1:
+        for filename in list_of_files:
+            try:
+                result = decode_file(filename)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(filename, e)
+                continue
+            yield result
+        return
+
+    # workers are spawned rather than forked, since forking a process with
+    # live gRPC channels is not supported by grpc
+    with futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        names = {}
+        slots = threading.Semaphore(workers)
+        stop = threading.Event()
+        # the submitted futures, then the error that ended list_of_files
+        # (if any) and None
+        submitted = queue.Queue()
+
+        def fill():
+            # list_of_files may block (e.g. a watch.FolderWatcher), so it is
+            # read by its own thread and never holds back a decoded file
+            try:
+                for filename in list_of_files:
+                    slots.acquire()
+                    if stop.is_set():
+                        return
+                    fut = pool.submit(decode_file, filename)
+                    names[fut] = filename
+                    submitted.put(fut)
+            except Exception as e:
+                submitted.put(e)
+            finally:
+                submitted.put(None)
+
+        threading.Thread(target=fill, daemon=True).start()
+        pending = collections.deque()
+        filling = True
+        failure = None
+        try:
+            while pending or filling:
+                while filling:
+                    # only wait for a new file when none is decoding
+                    try:
+                        item = submitted.get(block=not pending)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        filling = False
+                    elif isinstance(item, Exception):
+                        failure = item
+                    else:
+                        pending.append(item)
+                if not pending:
+                    continue
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    for fut in done:
+                        pending.remove(fut)
+                for fut in done:
+                    filename = names.pop(fut)
+                    error = fut.exception()
+                    slots.release()
+                    if error is not None:
+                        if on_error is None:
+                            raise error
+                        on_error(filename, error)
+                        continue
+                    yield fut.result()
+            if failure is not None:
+                raise failure
+        finally:
+            stop.set()
+            slots.release()
+            for fut in pending:
+                fut.cancel()
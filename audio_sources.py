@@ -0,0 +1,170 @@
+"Live audio sources for the real-time client: microphone, WAV replay, raw PCM from stdin and UDP"
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+class AudioSource:
+    """A live source of 16 bit mono PCM at fs Hz.
+
+    start() writes the captured samples into a realtime.RingBuffer from a
+    background thread, and closes the ring once the source is exhausted or
+    stop() is called. Subclasses implement blocks(), yielding raw
+    little-endian int16 bytes.
+    """
+    fs = 8000
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def blocks(self):
+        raise NotImplementedError
+
+    def start(self, ring):
+        self._thread = threading.Thread(target=self._run, args=(ring,), daemon=True)
+        self._thread.start()
+
+    def _run(self, ring):
+        remainder = b''
+        try:
+            for block in self.blocks():
+                if self._stop.is_set():
+                    break
+                if remainder:
+                    block = remainder + block
+                # keep a trailing odd byte for the next block
+                remainder = block[len(block) - len(block) % 2:]
+                ring.write(np.frombuffer(block, dtype=np.int16, count=len(block) // 2))
+        finally:
+            ring.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+class MicrophoneSource(AudioSource):
+    """Captures the default input device through a PyAudio callback."""
+    def __init__(self, fs=8000, frames_per_buffer=1024):
+        super().__init__()
+        self.fs = fs
+        self.frames_per_buffer = frames_per_buffer
+        self._pa = None
+        self._stream = None
+        self._ring = None
+
+    def start(self, ring):
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            # called by PyAudio's capture thread; never waits for predictions.
+            # in_data already holds int16 samples, viewed without conversion
+            ring.write(np.frombuffer(in_data, dtype=np.int16))
+            return None, pyaudio.paContinue
+
+        self._ring = ring
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(format=pyaudio.paInt16, channels=1, rate=self.fs,
+                                     input=True, frames_per_buffer=self.frames_per_buffer,
+                                     stream_callback=callback)
+        self._stream.start_stream()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._pa.terminate()
+            self._stream = None
+            self._ring.close()
+
+
+class WavFileSource(AudioSource):
+    """Replays an audio file at real-time pace (or speed times faster).
+
+    Files that are not fs Hz mono int16 WAV are decoded and resampled
+    up front.
+    """
+    def __init__(self, path, fs=8000, speed=1.0, block_duration=0.1):
+        super().__init__()
+        self.path = path
+        self.fs = fs
+        self.speed = speed
+        self.block_size = int(fs * block_duration)
+
+    def blocks(self):
+        from audio_io import decode_file
+        _, data, _, _, _ = decode_file(self.path, self.fs)
+        block_bytes = 2 * self.block_size
+        t0 = time.time()
+        for offset in range(0, len(data), block_bytes):
+            block = data[offset:offset + block_bytes]
+            # a block is only available once it has been "played"
+            due = t0 + (offset + len(block)) / 2 / self.fs / self.speed
+            time.sleep(max(0.0, due - time.time()))
+            yield block
+
+
+class RawPCMSource(AudioSource):
+    """Reads raw little-endian int16 mono PCM from a binary file object,
+    by default stdin (e.g. `arecord -r 8000 -f S16_LE -t raw | ...`)."""
+    def __init__(self, fileobj=None, fs=8000, block_duration=0.1):
+        super().__init__()
+        self.fileobj = fileobj if fileobj is not None else sys.stdin.buffer
+        self.fs = fs
+        self.block_size = int(fs * block_duration)
+
+    def blocks(self):
+        read = getattr(self.fileobj, 'read1', self.fileobj.read)
+        while True:
+            block = read(2 * self.block_size)
+            if not block:
+                return
+            yield block
+
+
+class UDPSource(AudioSource):
+    """Receives raw little-endian int16 mono PCM datagrams on host:port.
+
+    With rtp, the 12 byte fixed RTP header (plus its CSRC list) is stripped
+    from each datagram. The source ends after timeout seconds without data.
+    """
+    def __init__(self, host='0.0.0.0', port=5004, fs=8000, rtp=False, timeout=10.0):
+        super().__init__()
+        self.fs = fs
+        self.rtp = rtp
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+
+    def blocks(self):
+        self.sock.settimeout(self.timeout)
+        try:
+            while True:
+                try:
+                    packet = self.sock.recv(65536)
+                except socket.timeout:
+                    return
+                if self.rtp:
+                    packet = packet[12 + 4 * (packet[0] & 0x0F):]
+                yield packet
+        finally:
+            self.sock.close()
+
+
+def from_spec(spec, fs=8000, speed=1.0):
+    """Creates a source from a command line spec: mic, stdin, wav:<path>,
+    udp:<host>:<port> or rtp:<host>:<port>."""
+    kind, _, arg = spec.partition(':')
+    if kind == 'mic':
+        return MicrophoneSource(fs)
+    if kind == 'stdin':
+        return RawPCMSource(fs=fs)
+    if kind == 'wav':
+        return WavFileSource(arg, fs, speed=speed)
+    if kind in ('udp', 'rtp'):
+        host, _, port = arg.rpartition(':')
+        return UDPSource(host or '0.0.0.0', int(port), fs, rtp=(kind == 'rtp'))
+    raise ValueError(f"Unknown audio source {spec!r}")
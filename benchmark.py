@@ -0,0 +1,236 @@
+"""
+Benchmarks for the client side of the Deep Audio API
+Usage:
+python3 benchmark.py payload <wav_file>
+python3 benchmark.py import [--budget <seconds>]
+python3 benchmark.py realtime [--blocks <n>]
+python3 benchmark.py filter [--windows <n>]
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on MacOS and in kilobytes on Linux
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def build_payload(filename, mode, chunk_duration=10):
+    import numpy as np
+    import librosa
+    import magcil_api_pb2
+    import audio_io
+
+    before = peak_rss_mb()
+    t1 = time.time()
+    if mode == 'librosa':
+        x, fs = librosa.load(filename, sr=8000, mono=True)
+        dimension = x.shape
+        x = (x * (2 ** 15)).astype('int16')
+        data = x.tobytes()
+    elif mode == 'wave':
+        _, data, dimension, fs, _ = audio_io.decode_file(filename)
+    else:
+        # one chunk request at a time, as sent with -c
+        size = 0
+        for data, dimension, fs in audio_io.iter_chunks(filename, chunk_duration):
+            request = magcil_api_pb2.AudioRequest(
+                filename=filename, dimension=dimension, data=data, fs=fs)
+            size += len(request.data)
+        return size, peak_rss_mb() - before, time.time() - t1
+    request = magcil_api_pb2.AudioRequest(
+        filename=filename, dimension=dimension, data=data, fs=fs)
+    elapsed = time.time() - t1
+    return len(request.data), peak_rss_mb() - before, elapsed
+
+
+def bench_payload(filename):
+    """Reports the peak RSS needed to build the AudioRequests of a file per
+    ingestion path: one request for librosa and wave, one request per 10
+    second chunk for chunks.
+
+    Each path runs in a fresh interpreter, since the peak RSS of a process
+    never decreases.
+    """
+    print("%-8s %12s %14s %10s" % ("mode", "payload MB", "peak RSS MB", "time s"))
+    for mode in ('librosa', 'wave', 'chunks'):
+        out = subprocess.check_output(
+            [sys.executable, __file__, 'payload', filename, '--mode', mode])
+        size, rss, elapsed = out.split()
+        print("%-8s %12.1f %14.1f %10.3f" % (
+            mode, int(size) / 2 ** 20, float(rss), float(elapsed)))
+
+
+IMPORT_SNIPPET = """
+import sys, time
+t1 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t1, sorted(m for m in {heavy} if m in sys.modules))
+"""
+HEAVY_MODULES = ('librosa', 'numba', 'tqdm', 'scipy', 'matplotlib')
+
+
+def bench_import(module, budget, repeat):
+    """Measures the time to import module in a fresh interpreter.
+
+    Exits with an error if the median time is over budget seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True)
+        elapsed, loaded = out.split(' ', 1)
+        times.append(float(elapsed))
+    median = sorted(times)[len(times) // 2]
+    print("import %s: median %.3f s over %d runs (budget %.3f s)" % (
+        module, median, repeat, budget))
+    print("heavy modules loaded:", loaded.strip())
+    if median > budget:
+        sys.exit("import %s is over its time budget" % module)
+
+
+def bench_realtime(blocks, fs=8000, window=1.0):
+    """CPU time per block of turning captured int16 bytes into an AudioRequest:
+    the former struct.unpack / tuple path against the ring buffer path."""
+    import struct
+    import numpy as np
+    import magcil_api_pb2
+    import realtime
+
+    size = int(fs * window)
+    rng = np.random.default_rng(0)
+    captured = [(rng.standard_normal(size) * 3000).astype('<i2').tobytes()
+                for _ in range(8)]
+
+    def unpack_path(block):
+        shorts = struct.unpack("%dh" % (len(block) / 2), block)
+        x = np.array(shorts)
+        dimension = x.shape
+        x = x.astype('int16')
+        return magcil_api_pb2.AudioRequest(dimension=dimension, data=x.tobytes(), fs=fs)
+
+    ring = realtime.RingBuffer(size * 4 + size // 3)
+
+    def ring_path(block):
+        ring.write(np.frombuffer(block, dtype=np.int16))
+        data = ring.read_bytes(ring.written - size, size)
+        return magcil_api_pb2.AudioRequest(dimension=(size,), data=data, fs=fs)
+
+    print("%-8s %16s" % ("path", "CPU us / block"))
+    for name, path in (('unpack', unpack_path), ('ring', ring_path)):
+        t1 = time.process_time()
+        for i in range(blocks):
+            path(captured[i % len(captured)])
+        elapsed = time.process_time() - t1
+        print("%-8s %16.1f" % (name, elapsed / blocks * 1e6))
+
+
+def legacy_med_filter(signal, frame_size):
+    """The former med_filter of client-youtube.py, kept as a baseline."""
+    def filter_instance(x):
+        cnt_dict = {}
+        for inst in x:
+            if inst not in cnt_dict:
+                cnt_dict[inst] = 1
+            else:
+                cnt_dict[inst] += 1
+        maximum = 0
+        pred = x[0]
+        for key, value in cnt_dict.items():
+            if value > maximum:
+                maximum = value
+                pred = key
+        return [pred for _ in range(len(x))]
+
+    preds = list(signal)
+    idx = 0
+    while idx + frame_size + 1 <= len(signal):
+        preds[idx:(idx + frame_size + 1)] = filter_instance(signal[idx:(idx + frame_size + 1)])
+        idx = idx + 1
+    return preds
+
+
+def bench_filter(windows, size, n_classes=4, legacy_windows=100000):
+    """Time of smoothing `windows` predictions with a sliding mode filter of
+    `size` windows: the former med_filter (on at most legacy_windows labels,
+    extrapolated linearly) against smoothing.mode_filter."""
+    import numpy as np
+    import smoothing
+
+    rng = np.random.default_rng(0)
+    # runs of random lengths, with isolated errors to smooth away
+    pred = np.repeat(rng.integers(0, n_classes, windows),
+                     rng.integers(1, 20, windows))[:windows].astype(np.int32)
+    noise = rng.random(windows) < 0.1
+    pred[noise] = rng.integers(0, n_classes, noise.sum())
+    labels = np.array(["class_%d" % c for c in range(n_classes)])
+
+    n = min(windows, legacy_windows)
+    signal = labels[pred[:n]].tolist()
+    t1 = time.perf_counter()
+    legacy_med_filter(signal, size - 1)
+    legacy = (time.perf_counter() - t1) * windows / n
+
+    t1 = time.perf_counter()
+    smoothing.mode_filter(pred, size, n_classes)
+    vectorized = time.perf_counter() - t1
+
+    print("%-12s %12s" % ("filter", "time s"))
+    print("%-12s %12.3f%s" % ("med_filter", legacy, " (extrapolated)" if n < windows else ""))
+    print("%-12s %12.3f" % ("mode_filter", vectorized))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    payload = subparsers.add_parser(
+        'payload', help='Peak memory of building the AudioRequest of a WAV file')
+    payload.add_argument('input', type=str, help='Input wav file')
+    payload.add_argument('--mode', type=str, default=None,
+                         choices=['librosa', 'wave', 'chunks'],
+                         help='Measure a single ingestion path (used internally).')
+
+    imports = subparsers.add_parser(
+        'import', help='Time to import a client module, checked against a budget')
+    imports.add_argument('--module', type=str, default='client',
+                         help='Module to import. Default is client.')
+    imports.add_argument('--budget', type=float, default=0.5,
+                         help='Maximum median import time in seconds. Default is 0.5.')
+    imports.add_argument('--repeat', type=int, default=5,
+                         help='Number of fresh interpreters to time. Default is 5.')
+
+    rt = subparsers.add_parser(
+        'realtime', help='CPU time of preparing one real-time block for sending')
+    rt.add_argument('--blocks', type=int, default=2000,
+                    help='Number of 1 second blocks to process. Default is 2000.')
+
+    filt = subparsers.add_parser(
+        'filter', help='Time of smoothing predictions with a sliding mode filter')
+    filt.add_argument('--windows', type=int, default=1000000,
+                      help='Number of predicted windows. Default is 1000000.')
+    filt.add_argument('--size', type=int, default=4,
+                      help='Filter length in windows. Default is 4.')
+
+    FLAGS = parser.parse_args()
+
+    if FLAGS.benchmark == 'payload':
+        if FLAGS.mode is None:
+            bench_payload(FLAGS.input)
+        else:
+            print(*build_payload(FLAGS.input, FLAGS.mode))
+    elif FLAGS.benchmark == 'import':
+        bench_import(FLAGS.module, FLAGS.budget, FLAGS.repeat)
+    elif FLAGS.benchmark == 'realtime':
+        bench_realtime(FLAGS.blocks)
+    elif FLAGS.benchmark == 'filter':
+        bench_filter(FLAGS.windows, FLAGS.size)
@@ -0,0 +1,147 @@
+"On-disk cache of model predictions, keyed by the content of the audio they were computed on"
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import magcil_api_pb2
+
+
+def audio_key(data, fs):
+    """Content hash of the int16 payload of an AudioRequest and its fs."""
+    h = hashlib.sha256()
+    h.update(data)
+    h.update(repr(fs).encode('utf-8'))
+    return h.hexdigest()
+
+
+def split_reply(reply):
+    """Splits a MagCilReply into {model: single-model MagCilReply}."""
+    parts = {}
+    for i, model_name in enumerate(reply.model_name):
+        part = magcil_api_pb2.MagCilReply(filename=reply.filename)
+        part.model_name.append(model_name)
+        part.step.append(reply.step[i])
+        part.preds.add().CopyFrom(reply.preds[i])
+        part.classes.add().CopyFrom(reply.classes[i])
+        parts[model_name] = part
+    return parts
+
+
+def merge_replies(filename, models, parts):
+    """Joins single-model replies into one MagCilReply, in the order of models.
+
+    Models missing from parts are logged and left out of the reply.
+    """
+    reply = magcil_api_pb2.MagCilReply(filename=filename)
+    missing = [model for model in models if model not in parts]
+    if missing:
+        logging.warning("No predictions of %s for %s", ", ".join(missing), filename)
+    for model in models:
+        part = parts.get(model)
+        if part is None:
+            continue
+        reply.model_name.extend(part.model_name)
+        reply.step.extend(part.step)
+        reply.preds.extend(part.preds)
+        reply.classes.extend(part.classes)
+    return reply
+
+
+class PredictionCache:
+    """SQLite store of per-model predictions with size-based LRU eviction.
+
+    Predictions are stored per (audio hash, model, model_version), so a
+    request only has to ask the server for the models missing from the
+    cache. When the stored predictions exceed max_size bytes, the least
+    recently used ones are evicted. The cache may be shared by the threads
+    of one client.
+    """
+    def __init__(self, path, max_size=2 ** 30):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "audio TEXT, model TEXT, model_version TEXT, reply BLOB, size INTEGER, "
+            "last_used REAL, PRIMARY KEY (audio, model, model_version))")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)")
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+
+    def get(self, audio, models, model_version=""):
+        """Returns {model: single-model MagCilReply} of the cached models."""
+        parts = {}
+        with self._lock:
+            now = time.time()
+            for model in models:
+                row = self._db.execute(
+                    "SELECT reply FROM predictions "
+                    "WHERE audio = ? AND model = ? AND model_version = ?",
+                    (audio, model, model_version)).fetchone()
+                if row is None:
+                    continue
+                self._db.execute(
+                    "UPDATE predictions SET last_used = ? "
+                    "WHERE audio = ? AND model = ? AND model_version = ?",
+                    (now, audio, model, model_version))
+                parts[model] = magcil_api_pb2.MagCilReply.FromString(row[0])
+            self._db.commit()
+        return parts
+
+    def put(self, audio, reply, model_version=""):
+        """Stores the predictions of every model in reply separately."""
+        with self._lock:
+            now = time.time()
+            for model, part in split_reply(reply).items():
+                blob = part.SerializeToString()
+                old = self._db.execute(
+                    "SELECT size FROM predictions "
+                    "WHERE audio = ? AND model = ? AND model_version = ?",
+                    (audio, model, model_version)).fetchone()
+                if old is not None:
+                    self._size -= old[0]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                    (audio, model, model_version, blob, len(blob), now))
+                self._size += len(blob)
+            self._evict()
+            self._db.commit()
+
+    def lookup(self, data, fs, models, model_version=""):
+        """Returns (audio hash, cached parts, models still to be requested)."""
+        audio = audio_key(data, fs)
+        parts = self.get(audio, models, model_version)
+        return audio, parts, [model for model in models if model not in parts]
+
+    def complete(self, audio, models, parts, reply, model_version=""):
+        """Stores the reply to a pruned request and merges it with the cached
+        parts into one reply with all models; models the server did not
+        return are logged and left out."""
+        self.put(audio, reply, model_version)
+        parts = dict(parts, **split_reply(reply))
+        return merge_replies(reply.filename, models, parts)
+
+    def _evict(self):
+        while self._size > self.max_size:
+            rows = self._db.execute(
+                "SELECT rowid, size FROM predictions ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for rowid, size in rows:
+                if self._size <= self.max_size:
+                    break
+                self._db.execute("DELETE FROM predictions WHERE rowid = ?", (rowid,))
+                self._size -= size
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
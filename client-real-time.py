@@ -1,110 +1,60 @@
 from __future__ import print_function
 import argparse
-import numpy as np
-import librosa
-import scipy.io.wavfile as wavfile
 import logging
-import os
 import sys
-import contextlib
-import wave
-import grpc
-import magcil_api_pb2
+import threading
 import magcil_api_pb2_grpc
-import time
-from datetime import datetime
+import audio_sources
+import client
+import realtime
 
 "Client of the whole/end-to-end pipeline including both grpc and triton servers"
 
-def get_wav_duration(fname):
-    with contextlib.closing(wave.open(fname,'r')) as f:
-        frames = f.getnframes()
-        rate = f.getframerate()
-        duration = frames / float(rate)
-        return duration
-
-class GrpcAuth(grpc.AuthMetadataPlugin):
-    def __init__(self, key, user):
-        self._key = key
-        self._user = user
-
-    def __call__(self, context, callback):
-        callback((('token', self._key), ('user', self._user),), None)
-
-with open('ssl_keys/ca.crt', 'rb') as fh:
-    root_cert = fh.read()
-with open('ssl_keys/client.crt', 'rb') as fh:
-    client_cert = fh.read() 
-with open('ssl_keys/client.key', 'rb') as fh:
-    client_key = fh.read()
-
 
 def run(models, token, username, model_version="", url='localhost:50051',
-        root_certificates=None, private_key=None, certificate_chain=None): 
+        root_certificates=None, private_key=None, certificate_chain=None,
+        window=1.0, hop=None, buffer_duration=10.0, source='mic', speed=1.0,
+        streams=1, max_pending=4, drop='drop_oldest'):
     print(url)
-    with grpc.secure_channel(url, grpc.composite_channel_credentials(
-        grpc.ssl_channel_credentials(root_certificates=root_cert,
-                                     private_key=client_key,
-                                     certificate_chain=client_cert),
-        grpc.metadata_call_credentials(
-            GrpcAuth(token, username)))) as channel:
+    sources = [source] if isinstance(source, str) else source
+    with client.create_channel(url, token, username,
+                               root_certificates=root_certificates,
+                               private_key=private_key,
+                               certificate_chain=certificate_chain) as channel:
+        stub = magcil_api_pb2_grpc.AudioModelsPredictStub(channel)
+        if len(sources) == 1:
+            audio_source = audio_sources.from_spec(sources[0], speed=speed)
+            for response, latency in realtime.stream_source(
+                    stub, audio_source, models, model_version,
+                    window=window, hop=hop, buffer_duration=buffer_duration):
+                print(client.reply_to_dict(response))
+                print(f"latency: {latency:.3f} s")
+            return
+
+        # many feeds multiplexed on a few Predict streams
+        manager = realtime.StreamManager(stub, streams, max_pending=max_pending, drop=drop)
+        feeds = [manager.add_source(str(i), audio_sources.from_spec(spec, speed=speed),
+                                    models, model_version, window=window, hop=hop,
+                                    buffer_duration=buffer_duration)
+                 for i, spec in enumerate(sources)]
+
+        def consume(feed, spec):
+            for seq, response, latency in feed.replies():
+                print(f"{spec} #{seq}: {client.reply_to_dict(response)} "
+                      f"latency: {latency:.3f} s")
+            print(f"{spec}: {feed.sent} windows sent, {feed.dropped} dropped")
+
+        consumers = [threading.Thread(target=consume, args=(feed, spec), daemon=True)
+                     for feed, spec in zip(feeds, sources)]
+        for consumer in consumers:
+            consumer.start()
         try:
-            grpc.channel_ready_future(channel).result(timeout=3)
-        except grpc.FutureTimeoutError:
-            sys.exit('Error connecting to server')
-        else:
-            stub = magcil_api_pb2_grpc.AudioModelsPredictStub(channel)
-
-            import pyaudio
-            import struct
-
-            fs = 8000
-            FORMAT = pyaudio.paInt16
-            mid_buf_size = int(fs * 1.0) # 1 sec 
-            pa = pyaudio.PyAudio()
-            stream = pa.open(format=FORMAT, channels=1, rate=fs,
-                             input=True, frames_per_buffer=mid_buf_size)
-            count = 0
-            while (1):
-                count += 1
-                block = stream.read(mid_buf_size)
-                # number of samples (assuming 16 bit sample resolution)
-                count_samples = len(block) / 2  
-                # convert byte sequences to list of 16bit samples
-                format = "%dh" % (count_samples)
-                shorts = struct.unpack(format, block)
-
-                t1 = time.time()
+            for consumer in consumers:
+                consumer.join()
+        finally:
+            manager.close()
 
-                x = np.array(shorts)
-                dimension = x.shape
-                x = x.astype('int16')
-                now = datetime.now()
-                dt_string = now.strftime("%Y_%m_%d__%H_%M_%S")
-                filename = f"{dt_string}.wav"
 
-                data = x.tobytes()
-                request = magcil_api_pb2.AudioRequest(
-                    filename=filename, dimension=dimension,
-                    data=data, fs=fs, models=models,
-                    model_version=model_version)
-                for response in stub.Predict(iter([request])):
-                    number_of_models = len(response.model_name)
-                    keys = []
-                    values = [[] for i in range(number_of_models)]
-                    for i in range(number_of_models):
-                        preds = response.preds[i]
-                        classes = response.classes[i]
-                        pred_classes = [classes.cl[pred] for pred in preds.p]
-                        st = 0
-                        for j in pred_classes:
-                            et = st + response.step[i]
-                            values[i].append({"st": st, "et": et, "class": j})
-                            st += response.step[i]
-                        keys.append(response.model_name[i])
-                    dicts = dict(zip(keys, values))
-                    print(dicts)
-                print(time.time() - t1)
 if __name__ == '__main__':
     logging.basicConfig()
 
@@ -134,21 +84,21 @@ if __name__ == '__main__':
         type=str,
         required=False,
         default=None,
-        help='File holding PEM-encoded root certificates. Default is None.')
+        help='File holding PEM-encoded root certificates. Default is ssl_keys/ca.crt.')
     parser.add_argument(
         '-pk',
         '--private_key',
         type=str,
         required=False,
         default=None,
-        help='File holding PEM-encoded private key. Default is None.')
+        help='File holding PEM-encoded private key. Default is ssl_keys/client.key.')
     parser.add_argument(
         '-cc',
         '--certificate_chain',
         type=str,
         required=False,
         default=None,
-        help='File holding PEM-encoded certicate chain. Default is None.')
+        help='File holding PEM-encoded certicate chain. Default is ssl_keys/client.crt.')
     parser.add_argument(
         '-t',
         '--token',
@@ -160,14 +110,81 @@ if __name__ == '__main__':
         type=str,
         required=True,
         help='Username')  
+    parser.add_argument(
+        '-w',
+        '--window',
+        type=float,
+        required=False,
+        default=1.0,
+        help='Duration in seconds of the audio sent for each prediction. Default is 1.')
+    parser.add_argument(
+        '--hop',
+        type=float,
+        required=False,
+        default=None,
+        help='Seconds between the starts of consecutive windows; windows '
+             'overlap if it is shorter than --window. Default is --window.')
+    parser.add_argument(
+        '--buffer',
+        type=float,
+        required=False,
+        default=10.0,
+        help='Seconds of captured audio kept in the ring buffer. Default is 10.')
+    parser.add_argument(
+        '-s',
+        '--source',
+        nargs='+',
+        type=str,
+        required=False,
+        default=['mic'],
+        help='Audio source(s): mic, stdin (raw 8 kHz mono s16le), wav:<audio file> '
+             '(replayed in real time), udp:<host>:<port> or rtp:<host>:<port>. '
+             'Several sources are multiplexed on --streams Predict streams. '
+             'Default is mic.')
+    parser.add_argument(
+        '--speed',
+        type=float,
+        required=False,
+        default=1.0,
+        help='Replay speed of wav: sources relative to real time. Default is 1.')
+    parser.add_argument(
+        '--streams',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of Predict streams shared by multiple sources. Default is 1.')
+    parser.add_argument(
+        '--max_pending',
+        type=int,
+        required=False,
+        default=4,
+        help='Windows of a source that may wait while the server falls behind. Default is 4.')
+    parser.add_argument(
+        '--drop',
+        type=str,
+        required=False,
+        default='drop_oldest',
+        choices=realtime.DROP_POLICIES,
+        help='What to do with a new window when --max_pending windows of its source '
+             'are waiting: block, drop_oldest or drop_newest. Default is drop_oldest.')
 
 
     FLAGS = parser.parse_args()
 
-    run(
-        FLAGS.model, FLAGS.token, FLAGS.username, FLAGS.model_version, FLAGS.url,
-        root_certificates=FLAGS.root_certificates,
-        private_key=FLAGS.private_key,
-        certificate_chain=FLAGS.certificate_chain
-    )
-
+    try:
+        run(
+            FLAGS.model, FLAGS.token, FLAGS.username, FLAGS.model_version, FLAGS.url,
+            root_certificates=FLAGS.root_certificates,
+            private_key=FLAGS.private_key,
+            certificate_chain=FLAGS.certificate_chain,
+            window=FLAGS.window,
+            hop=FLAGS.hop,
+            buffer_duration=FLAGS.buffer,
+            source=FLAGS.source,
+            speed=FLAGS.speed,
+            streams=FLAGS.streams,
+            max_pending=FLAGS.max_pending,
+            drop=FLAGS.drop
+        )
+    except ConnectionError as e:
+        sys.exit(str(e))
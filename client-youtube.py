@@ -6,149 +6,82 @@ python3 src/client-youtube.py -m <model> -i <youtube_url> -t <token> -u <inferen
 
 from __future__ import print_function
 import argparse
-import youtube_dl
+import json
+import os
+import sys
+import tempfile
+import wave
 import numpy as np
 import client
+import ingest
+import smoothing
+import timeline
+from segments import find_segments
+from discovery import read_file_list
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 import platform
 
 
-def filter_instance(x):
-    cnt_dict = {}
-    for inst in x:
-        if inst not in cnt_dict:
-            cnt_dict[inst] = 1
-        else:
-            cnt_dict[inst] += 1
-
-    maximum = 0
-    pred = x[0]
-    for key, value in cnt_dict.items():
-        if value > maximum:
-            maximum = value
-            pred = key
-    return [pred for _ in range(len(x))]
-
-
-def med_filter(signal, frame_size):
-    preds = list(signal)
-    idx = 0
-    signal_len =len(signal)
-    while idx + frame_size + 1 <= signal_len:
-        preds[idx:(idx + frame_size + 1)] = filter_instance(signal[idx:(idx + frame_size + 1)])
-        idx = idx + 1
-    return preds
-
-
-def find_segments(preds):
-    segments = []
-    start = 0
-    previous = ""
-    for idx, inst in enumerate(preds):
-        if inst == previous:
-            idx += 1
-        else:
-            segments.append((start, idx - 1))
-            previous = inst
-            start = idx
-    filtered_segs = []
-    for idx, seg in enumerate(segments):
-        if seg[1] - seg[0] >= 5:
-            filtered_segs.append(seg)
-
-    return filtered_segs
-
-
-def get_rect_coords(rect):
-    xy = rect.get_xy()
-    width = rect.get_width()
-
-    x0 = xy[0]
-    x1 = x0 + width
-    return x0, x1
-
-
-def plot_rectangles(y_points):
-    start = (0, 0)
-    width = 0
-    height = 0.6
-    previous = -1
-    rectangles = []
-
-    for idx, pred in enumerate(y_points):
-        if pred == previous:
-            width += 1
-        else:
-            if width >= 5:
-                rect = Rectangle(start, width + 1, height,
-                                              edgecolor='green',
-                                              facecolor='none',
-                                              lw=3)
-                rectangles.append((start[0], start[0] + width + 1))
-                plt.gca().add_patch(rect)
-            previous = pred
-            width = 0
-            start = (idx-0.3, pred-0.3)
-    return rectangles
-
-
 class PlaySound:
-    def __init__(self, rectangles):
-        self.rectangles = rectangles
-        self.width = 0
+    def __init__(self, lanes, audio, fs=8000):
+        self.lanes = lanes
+        self.audio = audio
+        self.fs = fs
         self.height = 0.6
 
-    def play(self, event):
-        x = event.xdata
-        for rect in self.rectangles:
-            if rect[0] <= x <= rect[1]:
-                start = rect[0] + (rect[1] - rect[0]) / 2 - 2
-
-                rect = Rectangle(rect, self.width + 1, self.height,
-                                              edgecolor="red",
-                                              facecolor='none',
-                                              lw=3)
-                plt.gca().add_patch(rect)
-                os.system(f"ffmpeg -i temp.wav -ss {start} "
-                          f"-t 5 temp2.wav -y")
-
-                if platform.system() == "Darwin":  # MacOS
-                    os.system("play temp2.wav")
-                elif platform.system() == "Linux":
-                    os.system("aplay temp2.wav")
-
-                rect = Rectangle(rect, self.width + 1, self.height,
-                                 edgecolor="green",
-                                 facecolor='none',
-                                 lw=3)
-                plt.gca().add_patch(rect)
-        return
-
-
-def plot_magic(preds):
-    classes = set(preds)
-
-    class_dict = {}
-    idx = 1
-    for inst in classes:
-        class_dict[inst] = idx
-        idx += 1
-
-    y_points = []
-    for pred in preds:
-        y_points.append(class_dict[pred])
-
-    fig, ax = plt.subplots()
-    ax.scatter(range(len(preds)), y_points, s=15)
-    ax.set_facecolor("gainsboro")
-    plt.grid()
-    plt.yticks(
-        ticks=[value for key, value in class_dict.items()],
-        labels=[key for key, value in class_dict.items()])
+    def find(self, x, y):
+        """Returns the (segments, index, row) of the segment drawn at x, y."""
+        row = int(round(y))
+        for segments, base in self.lanes.values():
+            i = segments.at(x)
+            if i is not None and base + segments.label[i] == row:
+                return segments, i, row
+        return None
 
-    rectangles = plot_rectangles(y_points)
-    sound_player = PlaySound(rectangles)
+    def play(self, event):
+        if event.xdata is None or event.ydata is None:
+            return
+        found = self.find(event.xdata, event.ydata)
+        if found is None:
+            return
+        segments, i, row = found
+        st, et = segments.st[i], segments.et[i]
+        start = st + (et - st) / 2 - 2
+
+        rect = Rectangle((st, row - self.height / 2), et - st, self.height,
+                         edgecolor="red",
+                         facecolor='none',
+                         lw=3)
+        event.inaxes.add_patch(rect)
+        event.canvas.draw()
+        first = max(0, int(start * self.fs))
+        excerpt = self.audio[2 * first:2 * (first + 5 * self.fs)]
+        with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+            with wave.open(f.name, 'wb') as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(self.fs)
+                w.writeframes(excerpt)
+
+            if platform.system() == "Darwin":  # MacOS
+                os.system(f"play {f.name}")
+            elif platform.system() == "Linux":
+                os.system(f"aplay {f.name}")
+
+        rect.remove()
+        event.canvas.draw()
+
+
+def plot_magic(predictions, audio, fs=8000, min_duration=5):
+    """Shows the {model: ModelPredictions} of all models in stacked lanes of
+    one figure; clicking a segment plays 5 seconds from its middle."""
+    width, height = timeline.figure_size(predictions, 1200)
+    fig, ax = plt.subplots(figsize=(width, height))
+    lanes = timeline.draw(ax, predictions, min_duration,
+                          width=int(fig.get_figwidth() * fig.dpi))
+    fig.tight_layout()
+    sound_player = PlaySound(lanes, audio, fs)
     fig.canvas.mpl_connect('button_press_event', sound_player.play)
 
     plt.show()
@@ -181,7 +114,37 @@ if __name__ == '__main__':
                         type=str,
                         nargs='?',
                         default=None,
-                        help='Youtube link')
+                        help='Youtube link or local media file')
+    parser.add_argument('-l',
+                        '--input_list',
+                        type=str,
+                        required=False,
+                        default=None,
+                        help='File listing one Youtube link or local media file per line '
+                             '("-" for stdin). Runs headless, writing the predictions '
+                             'to --output instead of plotting them.')
+    parser.add_argument('-o',
+                        '--output',
+                        type=str,
+                        required=False,
+                        default='results.jsonl',
+                        help='JSON lines file of the predictions of --input_list. '
+                             'Default is results.jsonl.')
+    parser.add_argument('--download_workers',
+                        type=int,
+                        required=False,
+                        default=4,
+                        help='Concurrent downloads of --input_list. Default is 4.')
+    parser.add_argument('--transcode_workers',
+                        type=int,
+                        required=False,
+                        default=2,
+                        help='Concurrent ffmpeg decodes of --input_list. Default is 2.')
+    parser.add_argument('--infer_workers',
+                        type=int,
+                        required=False,
+                        default=4,
+                        help='Concurrent Predict streams of --input_list. Default is 4.')
     parser.add_argument(
         '-rc',
         '--root_certificates',
@@ -214,6 +177,29 @@ if __name__ == '__main__':
         type=str,
         required=True,
         help='Username')
+    parser.add_argument(
+        '-c',
+        '--chunk_duration',
+        type=float,
+        required=False,
+        default=10.0,
+        help='Seconds of audio per request; predictions start as soon as the '
+             'first chunk is downloaded. Should be a multiple of the model step. '
+             'Default is 10.')
+    parser.add_argument(
+        '--min_duration',
+        type=float,
+        required=False,
+        default=5.0,
+        help='Minimum duration in seconds of the highlighted (or, with '
+             '--input_list, exported) segments. Default is 5.')
+    parser.add_argument(
+        '--report',
+        type=str,
+        required=False,
+        default=None,
+        help='Write the plot to this .png, .svg or .html file instead of showing it. '
+             'With --input_list, a folder receiving one .html report per input.')
 
     FLAGS = parser.parse_args()
 
@@ -221,37 +207,72 @@ if __name__ == '__main__':
     # currently supports only one model
     models = FLAGS.model
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-    }
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        info_dict = ydl.extract_info(link, download=False)
-        video_title = info_dict.get('title', None)
-
-    path = f'{video_title}.mp3'
-    ydl_opts.update({'outtmpl':path})
-    print(path)
-
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([link])
-
-    import os
-    os.system(f"ffmpeg -i \"{path}\" -ar 8000 -ac 1 temp.wav -y")
-
-    _, _, r = client.run(
-        FLAGS.model, ["temp.wav"], FLAGS.token, FLAGS.username, FLAGS.model_version, FLAGS.url,
-        root_certificates=FLAGS.root_certificates,
-        private_key=FLAGS.private_key,
-        certificate_chain=FLAGS.certificate_chain
-    )
-
-    for model in models:
-        preds = [c["class"] for c in r[0][model]]
-        filtered_preds = med_filter(preds, 3)
-        filtered_preds = med_filter(filtered_preds, 3)
-        plot_magic(filtered_preds)
+    if FLAGS.input_list is not None:
+        sources = read_file_list(sys.stdin if FLAGS.input_list == '-' else FLAGS.input_list)
+        n_done = n_failed = 0
+        if FLAGS.report is not None:
+            os.makedirs(FLAGS.report, exist_ok=True)
+        try:
+            with client.ClientSession(FLAGS.token, FLAGS.username, [FLAGS.url],
+                                      FLAGS.root_certificates, FLAGS.private_key,
+                                      FLAGS.certificate_chain) as session, \
+                    open(FLAGS.output, 'w') as out:
+                for result in ingest.run_batch(
+                        session, models, sources, FLAGS.model_version,
+                        chunk_duration=FLAGS.chunk_duration,
+                        download_workers=FLAGS.download_workers,
+                        transcode_workers=FLAGS.transcode_workers,
+                        infer_workers=FLAGS.infer_workers,
+                        columnar=True):
+                    predictions = result.pop('predictions', None)
+                    n_done += 1
+                    if predictions is not None:
+                        filtered = {model: smoothing.smooth(p, 4, passes=2)
+                                    for model, p in predictions.items()}
+                        result['predictions'] = {model: p.to_dicts()
+                                                 for model, p in predictions.items()}
+                        result['segments'] = {
+                            model: find_segments(p, FLAGS.min_duration).to_dicts()
+                            for model, p in filtered.items()}
+                        if FLAGS.report is not None:
+                            result['report'] = os.path.join(FLAGS.report, f"{n_done}.html")
+                            timeline.export(filtered, result['report'], FLAGS.min_duration,
+                                            title=result['title'])
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                    n_failed += result['error'] is not None
+                    print(f"{n_done} done, {n_failed} failed: {result['input']}")
+        except OSError as e:
+            # server unreachable, unreadable input list or output file
+            sys.exit(str(e))
+        sys.exit(1 if n_failed else 0)
+
+    # the audio is downloaded and decoded by one ffmpeg process and sent in
+    # chunks as it arrives; the decoded audio is kept in memory for playback
+    pcm = []
+
+    def chunker(source, chunk_duration, sr=8000):
+        for data, dimension, fs in ingest.iter_pcm_chunks(source, chunk_duration, sr):
+            pcm.append(data)
+            yield data, dimension, fs
+
+    try:
+        _, _, r = client.run(
+            FLAGS.model, [link], FLAGS.token, FLAGS.username, FLAGS.model_version, FLAGS.url,
+            root_certificates=FLAGS.root_certificates,
+            private_key=FLAGS.private_key,
+            certificate_chain=FLAGS.certificate_chain,
+            chunk_duration=FLAGS.chunk_duration,
+            chunker=chunker,
+            columnar=True
+        )
+    except (OSError, RuntimeError) as e:
+        # server unreachable, missing ffmpeg, or a link or file that cannot be decoded
+        sys.exit(str(e))
+    audio = b''.join(pcm)
+
+    filtered = {model: smoothing.smooth(r[0][model], 4, passes=2) for model in models}
+    if FLAGS.report is not None:
+        timeline.export(filtered, FLAGS.report, FLAGS.min_duration, title=link)
+    else:
+        plot_magic(filtered, audio, min_duration=FLAGS.min_duration)
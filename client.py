@@ -1,26 +1,24 @@
 from __future__ import print_function
 import argparse
-import numpy as np
-import librosa
+import collections
+import functools
 import logging
 import os
+import queue
 import sys
-import contextlib
-import wave
+import threading
+import time
 import grpc
-from tqdm import tqdm
 import magcil_api_pb2
 import magcil_api_pb2_grpc
+from audio_io import get_wav_duration, iter_chunks, iter_decoded
+from results import concatenate, decode_reply
+from cache import PredictionCache, merge_replies
+from watch import FolderWatcher, Manifest
+from discovery import AUDIO_EXTENSIONS, discover, read_file_list
 
 "Client of the whole/end-to-end pipeline including both grpc and triton servers"
 
-def get_wav_duration(fname):
-    with contextlib.closing(wave.open(fname,'r')) as f:
-        frames = f.getnframes()
-        rate = f.getframerate()
-        duration = frames / float(rate)
-        return duration
-
 class GrpcAuth(grpc.AuthMetadataPlugin):
     def __init__(self, key, user):
         self._key = key
@@ -29,63 +27,556 @@ class GrpcAuth(grpc.AuthMetadataPlugin):
     def __call__(self, context, callback):
         callback((('token', self._key), ('user', self._user),), None)
 
-with open('ssl_keys/ca.crt', 'rb') as fh:
-    root_cert = fh.read()
-with open('ssl_keys/client.crt', 'rb') as fh:
-    client_cert = fh.read() 
-with open('ssl_keys/client.key', 'rb') as fh:
-    client_key = fh.read()
+# chunk requests are named <filename>#<chunk index>
+CHUNK_SEPARATOR = '#'
 
+SSL_KEYS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ssl_keys')
 
-def run(models, list_of_files, token, username, model_version="", url='localhost:50051',
-        root_certificates=None, private_key=None, certificate_chain=None): 
-    with grpc.secure_channel(url, grpc.composite_channel_credentials(
+
+@functools.lru_cache(maxsize=None)
+def _read_pem(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+def load_certificates(root_certificates=None, private_key=None, certificate_chain=None):
+    """Returns the PEM-encoded (root_cert, client_key, client_cert).
+
+    Files default to the ones in ssl_keys/ next to this module. They are
+    read on first use and cached.
+    """
+    return (_read_pem(root_certificates or os.path.join(SSL_KEYS_DIR, 'ca.crt')),
+            _read_pem(private_key or os.path.join(SSL_KEYS_DIR, 'client.key')),
+            _read_pem(certificate_chain or os.path.join(SSL_KEYS_DIR, 'client.crt')))
+
+
+def __getattr__(name):
+    # root_cert, client_key and client_cert used to be read at import time
+    certificates = ('root_cert', 'client_key', 'client_cert')
+    if name in certificates:
+        return load_certificates()[certificates.index(name)]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def channel_credentials(token, username, root_certificates=None, private_key=None,
+                        certificate_chain=None):
+    root_cert, client_key, client_cert = load_certificates(
+        root_certificates, private_key, certificate_chain)
+    return grpc.composite_channel_credentials(
         grpc.ssl_channel_credentials(root_certificates=root_cert,
                                      private_key=client_key,
                                      certificate_chain=client_cert),
         grpc.metadata_call_credentials(
-            GrpcAuth(token, username)))) as channel:
+            GrpcAuth(token, username)))
+
+
+class RequestStream:
+    """Lazily decodes files into AudioRequests for a Predict stream.
+
+    At most `max_in_flight` requests are decoded but not yet answered, so
+    memory stays bounded no matter how many files are listed. gRPC pulls
+    the next request from its own thread while replies are consumed, so
+    file N+1 is decoded while file N is being processed by the server.
+    With decode_workers > 1 files are decoded by a process pool, which may
+    hold up to decode_workers more files in memory; if ordered is False
+    requests are sent in the order their decoding finishes.
+
+    If chunk_duration is set, every file is split into requests of
+    chunk_duration seconds named <filename>#<chunk index>, each counting
+    as one in-flight request. Chunks are decoded in this process, in order,
+    by chunker(filename, chunk_duration), audio_io.iter_chunks by default;
+    ingest.iter_pcm_chunks streams links and media files through ffmpeg.
+
+    With a cache.PredictionCache, every decoded request is looked up in it
+    first and only asks for the models missing from the cache. Fully
+    cached replies are passed to on_cached instead of being sent; done()
+    stores the replies of the requests that were sent and merges them with
+    their cached models.
+
+    With progress, a progress bar of the decoded files is shown. If
+    on_error is given, whole files that cannot be decoded are passed to
+    on_error(filename, exception) and skipped instead of ending the stream.
+
+    Any other error raised while decoding or looking up requests ends the
+    stream cleanly and is kept in self.error, since grpc would only report
+    it as "Exception iterating requests!"; check() re-raises it.
+    """
+    def __init__(self, list_of_files, models, model_version="",
+                 max_in_flight=2, decode_workers=1, ordered=True,
+                 chunk_duration=None, cache=None, on_cached=None,
+                 chunker=None, progress=True, on_error=None):
+        self.list_of_files = list_of_files
+        self.models = models
+        self.model_version = model_version
+        self.decode_workers = decode_workers
+        self.ordered = ordered
+        self.chunk_duration = chunk_duration
+        self.cache = cache
+        self.on_cached = on_cached
+        self.chunker = chunker or iter_chunks
+        self.progress = progress
+        self.on_error = on_error
+        self.filenames = []
+        self.durations = []
+        self._pending = collections.defaultdict(collections.deque)
+        self._slots = threading.Semaphore(max_in_flight)
+        self._closed = threading.Event()
+        self.error = None
+
+    def __iter__(self):
         try:
-            grpc.channel_ready_future(channel).result(timeout=3)
-        except grpc.FutureTimeoutError:
-            sys.exit('Error connecting to server')
+            yield from self._requests()
+        except Exception as e:
+            self.error = e
+
+    def _requests(self):
+        from tqdm import tqdm
+        total = len(self.list_of_files) if hasattr(self.list_of_files, '__len__') else None
+        disable = not self.progress
+        if self.chunk_duration:
+            decoded = self._iter_chunks(tqdm(self.list_of_files, total=total, disable=disable))
         else:
-            stub = magcil_api_pb2_grpc.AudioModelsPredictStub(channel)
-            durations = []
-            requests = []
-            for filename in tqdm(list_of_files):
-                durations.append(get_wav_duration(filename))
-                x, fs = librosa.load(filename, sr=8000, mono=True)
-                dimension = x.shape
-                x = (x * (2 ** 15)).astype('int16')
-                data = x.tobytes()
-                request = magcil_api_pb2.AudioRequest(
-                    filename=filename, dimension=dimension,
-                    data=data, fs=fs, models=models,
-                    model_version=model_version)
-                requests.append(request)
-            responses = []
-            dict_responses = []
+            decoded = tqdm(iter_decoded(self.list_of_files, self.decode_workers,
+                                        self.ordered, self.on_error), total=total,
+                           disable=disable)
+        for filename, data, dimension, fs, duration in decoded:
+            if self._closed.is_set():
+                return
+            if duration is not None:
+                self.filenames.append(filename)
+                self.durations.append(duration)
+            models = self.models
+            if self.cache is not None:
+                audio, parts, models = self.cache.lookup(
+                    data, fs, self.models, self.model_version)
+                if not models:
+                    self.on_cached(merge_replies(filename, self.models, parts))
+                    continue
+                self._pending[filename].append((audio, parts))
+            self._slots.acquire()
+            if self._closed.is_set():
+                return
+            yield magcil_api_pb2.AudioRequest(
+                filename=filename, dimension=dimension,
+                data=data, fs=fs, models=models,
+                model_version=self.model_version)
+
+    def _iter_chunks(self, list_of_files):
+        for filename in list_of_files:
+            duration = 0.0
+            chunks = self.chunker(filename, self.chunk_duration)
+            for index, (data, dimension, fs) in enumerate(chunks):
+                duration += dimension[0] / float(fs)
+                yield f"{filename}{CHUNK_SEPARATOR}{index}", data, dimension, fs, None
+            # the duration is only known once every chunk has been decoded
+            self.filenames.append(filename)
+            self.durations.append(duration)
+
+    def done(self, response=None):
+        """Marks one request as answered, letting the next one be decoded.
+
+        Returns response, completed with the cached models of its request.
+        """
+        if self.cache is not None and response is not None:
+            pending = self._pending.get(response.filename)
+            if pending:
+                audio, parts = pending.popleft()
+                if not pending:
+                    del self._pending[response.filename]
+                response = self.cache.complete(audio, self.models, parts, response,
+                                               self.model_version)
+        self._slots.release()
+        return response
+
+    def check(self):
+        """Re-raises the error that ended the stream, if any."""
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self._closed.set()
+        self._slots.release()
+
+
+def reply_to_dict(response, offset=0):
+    """Converts a MagCilReply to {model: [{"st", "et", "class"}, ...]}.
+
+    offset (in seconds) is added to all window times.
+    """
+    return {model: predictions.to_dicts()
+            for model, predictions in decode_reply(response, offset).items()}
+
+
+def split_chunk_name(name):
+    """Returns the (filename, chunk index) encoded in a chunk request name."""
+    filename, _, index = name.rpartition(CHUNK_SEPARATOR)
+    return filename, int(index)
+
+
+def stitch_chunks(chunk_results):
+    """Merges {chunk index: decode_reply()} of one file into one timeline."""
+    parts = collections.OrderedDict()
+    for index in sorted(chunk_results):
+        for model, predictions in chunk_results[index].items():
+            parts.setdefault(model, []).append(predictions)
+    return {model: concatenate(predictions) for model, predictions in parts.items()}
+
+
+class ReplyCollector:
+    """Decodes MagCilReplies as they arrive.
+
+    Results are {model: ModelPredictions} per file if columnar, else the
+    {model: [{"st", "et", "class"}, ...]} view of them. Replies of chunk
+    requests are stitched back into one timeline per file by finish().
+    With verbose, the predictions are printed as they arrive. add() may be
+    called from several threads.
+    """
+    def __init__(self, chunk_duration=None, verbose=True, columnar=False):
+        self._lock = threading.Lock()
+        self.chunk_duration = chunk_duration
+        self.verbose = verbose
+        self.columnar = columnar
+        self.responses = []
+        self.filenames = []
+        self.dict_responses = []
+        self._chunks = collections.OrderedDict()
+
+    def _view(self, results):
+        if self.columnar:
+            return results
+        return {model: predictions.to_dicts() for model, predictions in results.items()}
+
+    def add(self, response):
+        with self._lock:
+            self._add(response)
+
+    def _add(self, response):
+        self.responses.append(response)
+        if self.verbose:
+            print("\n --> Predictions for file:", response.filename)
+        if self.chunk_duration:
+            filename, index = split_chunk_name(response.filename)
+            for step in response.step:
+                if index == 0 and self.chunk_duration % step:
+                    logging.warning(
+                        "Chunk duration %s is not a multiple of the model step %s",
+                        self.chunk_duration, step)
+            results = decode_reply(response, offset=index * self.chunk_duration)
+            self._chunks.setdefault(filename, {})[index] = results
+            results = self._view(results)
+        else:
+            results = self._view(decode_reply(response))
+            self.filenames.append(response.filename)
+            self.dict_responses.append(results)
+        if self.verbose:
+            print(results)
+
+    def finish(self, order=None):
+        """Stitches the chunks of every file. If order is given, filenames
+        and dict_responses are then sorted into it, e.g. the filenames of a
+        RequestStream, since cached replies are added before the replies of
+        earlier files."""
+        for filename, chunk_results in self._chunks.items():
+            self.filenames.append(filename)
+            self.dict_responses.append(self._view(stitch_chunks(chunk_results)))
+        self._chunks.clear()
+        if order is not None:
+            results = collections.defaultdict(collections.deque)
+            for filename, result in zip(self.filenames, self.dict_responses):
+                results[filename].append(result)
+            self.filenames = []
+            self.dict_responses = []
+            for filename in order:
+                if results[filename]:
+                    self.filenames.append(filename)
+                    self.dict_responses.append(results[filename].popleft())
+
+
+def create_channel(url, token, username, options=None, root_certificates=None,
+                   private_key=None, certificate_chain=None):
+    channel = grpc.secure_channel(url, channel_credentials(
+        token, username, root_certificates, private_key, certificate_chain),
+        options=options)
+    try:
+        grpc.channel_ready_future(channel).result(timeout=3)
+    except grpc.FutureTimeoutError:
+        channel.close()
+        raise ConnectionError(f"Error connecting to server {url}")
+    return channel
+
+
+class _Lane:
+    """One Predict stream fed from a queue, with its outstanding request count."""
+    def __init__(self, stub):
+        self.queue = queue.Queue()
+        self.outstanding = 0
+        self.call = stub.Predict(iter(self.queue.get, None))
+
+
+def _read_lane(lane, lock, replies):
+    try:
+        for response in lane.call:
+            with lock:
+                lane.outstanding -= 1
+            replies.put(response)
+    except grpc.RpcError as e:
+        replies.put(e)
+    replies.put(None)
+
+
+def _dispatch(requests, lanes, lock, replies):
+    """Sends each request to the lane with the fewest outstanding requests."""
+    try:
+        for request in requests:
+            with lock:
+                lane = min(lanes, key=lambda lane: lane.outstanding)
+                lane.outstanding += 1
+            lane.queue.put(request)
+    except Exception as e:
+        replies.put(e)
+    finally:
+        for lane in lanes:
+            lane.queue.put(None)
+
+
+class ClientSession:
+    """Long-lived pool of warm channels to one or more inference servers.
+
+    Channels are created (and their readiness awaited) on first use and
+    then reused by every call, so repeated calls skip the TLS handshake.
+    A channel that has been shut down, or that cannot become ready again
+    after a connection failure, is replaced on its next use.
+    """
+    def __init__(self, token, username, urls=('localhost:50051',),
+                 root_certificates=None, private_key=None, certificate_chain=None):
+        if isinstance(urls, str):
+            urls = [urls]
+        self.token = token
+        self.username = username
+        self.urls = list(urls)
+        self.certificates = (root_certificates, private_key, certificate_chain)
+        self._channels = {}
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def channel(self, url=None, index=0):
+        """Returns warm channel number index to url (default the first url).
+
+        Raises ConnectionError if no channel can be made ready. Readiness is
+        awaited without holding the session lock, so a reconnecting channel
+        does not stall the other threads.
+        """
+        key = (url or self.urls[0], index)
+        with self._lock:
+            channel = self._channels.get(key)
+            state = self._states.get(key)
+        if channel is not None and state in (grpc.ChannelConnectivity.SHUTDOWN,
+                                             grpc.ChannelConnectivity.TRANSIENT_FAILURE):
+            try:
+                grpc.channel_ready_future(channel).result(timeout=3)
+            except grpc.FutureTimeoutError:
+                with self._lock:
+                    if self._channels.get(key) is channel:
+                        del self._channels[key]
+                        self._states.pop(key, None)
+                channel.close()
+                channel = None
+        if channel is not None:
+            return channel
+        # a local subchannel pool gives every channel its own connection
+        channel = create_channel(key[0], self.token, self.username,
+                                 [('grpc.use_local_subchannel_pool', 1)],
+                                 *self.certificates)
+        with self._lock:
+            current = self._channels.get(key)
+            if current is not None:
+                # another thread reconnected first
+                channel.close()
+                return current
+            self._channels[key] = channel
+            self._states[key] = grpc.ChannelConnectivity.READY
+        channel.subscribe(
+            lambda state, key=key, channel=channel: self._on_state(key, channel, state))
+        return channel
+
+    def _on_state(self, key, channel, state):
+        with self._lock:
+            if self._channels.get(key) is channel:
+                self._states[key] = state
+
+    def close(self):
+        with self._lock:
+            for channel in self._channels.values():
+                channel.close()
+            self._channels.clear()
+            self._states.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, models, list_of_files, model_version="", url=None,
+            max_in_flight=2, decode_workers=1, ordered=True,
+            chunk_duration=None, columnar=False, cache=None, chunker=None,
+            verbose=True):
+        """Sends all files down one Predict stream, see the module level run().
+
+        With verbose False, nothing is printed. run() may be called from
+        several threads at once, each call opening its own stream.
+        """
+        stub = magcil_api_pb2_grpc.AudioModelsPredictStub(self.channel(url))
+        collector = ReplyCollector(chunk_duration, verbose=verbose, columnar=columnar)
+        requests = RequestStream(list_of_files, models, model_version,
+                                 max_in_flight=max_in_flight,
+                                 decode_workers=decode_workers,
+                                 ordered=ordered,
+                                 chunk_duration=chunk_duration,
+                                 cache=cache,
+                                 on_cached=collector.add,
+                                 chunker=chunker,
+                                 progress=verbose)
+        try:
             for response in stub.Predict(iter(requests)):
-                responses.append(response)
+                collector.add(requests.done(response))
+        except grpc.RpcError:
+            requests.check()
+            raise
+        finally:
+            requests.close()
+        requests.check()
+        collector.finish(requests.filenames)
+        return collector.responses, requests.durations, collector.dict_responses
+
+    def watch(self, models, watcher, model_version="", url=None, max_in_flight=2,
+              decode_workers=1, ordered=True, cache=None):
+        """Streams the files of a watch.FolderWatcher down one long-lived
+        Predict stream, printing their predictions and recording them as
+        processed as soon as they arrive.
+
+        Returns once the watcher is exhausted, which for a watching
+        FolderWatcher is never. If the stream of a watching FolderWatcher
+        breaks, the unanswered files are requeued and a new stream is opened.
+        """
+        lock = threading.Lock()
+
+        def handle(response):
+            with lock:
                 print("\n --> Predictions for file:", response.filename)
-                number_of_models = len(response.model_name)
-                keys = []
-                values = [[] for i in range(number_of_models)]
-                for i in range(number_of_models):
-                    preds = response.preds[i]
-                    classes = response.classes[i]
-                    pred_classes = [classes.cl[pred] for pred in preds.p]
-                    st = 0
-                    for j in pred_classes:
-                        et = st + response.step[i]
-                        values[i].append({"st": st, "et": et, "class": j})
-                        st += response.step[i]
-                    keys.append(response.model_name[i])
-                dicts = dict(zip(keys, values)) 
-                dict_responses.append(dicts)
-                print(dicts)
-        return responses, durations, dict_responses
+                print(reply_to_dict(response))
+                watcher.processed(response.filename)
+
+        def skip(filename, error):
+            # an undecodable file must not break the stream of the others
+            logging.warning("Skipping %s, which cannot be decoded (%s: %s)",
+                            filename, type(error).__name__, error)
+            watcher.failed(filename)
+
+        while True:
+            stub = magcil_api_pb2_grpc.AudioModelsPredictStub(self.channel(url))
+            requests = RequestStream(watcher, models, model_version,
+                                     max_in_flight=max_in_flight,
+                                     decode_workers=decode_workers,
+                                     ordered=ordered,
+                                     cache=cache,
+                                     on_cached=handle,
+                                     on_error=skip)
+            try:
+                for response in stub.Predict(iter(requests)):
+                    handle(requests.done(response))
+                requests.check()
+                return
+            except grpc.RpcError as e:
+                requests.check()
+                if not watcher.watch:
+                    raise
+                logging.warning("Predict stream broke (%s), reopening", e.code())
+                watcher.requeue()
+                time.sleep(watcher.interval)
+            finally:
+                requests.close()
+
+    def run_fanout(self, models, list_of_files, model_version="", streams_per_url=1,
+                   max_in_flight=None, decode_workers=1, ordered=True,
+                   chunk_duration=None, columnar=False, cache=None, verbose=True):
+        """Like run(), but spreads the files over several Predict streams.
+
+        streams_per_url streams, each on its own channel, are opened to every
+        url of the session, and each request goes to the stream with the
+        fewest outstanding requests. max_in_flight defaults to 2 requests
+        per stream. With verbose False, nothing is printed.
+
+        Returns (responses, durations, dict_responses), where responses are
+        in arrival order and durations and dict_responses are dicts keyed by
+        filename.
+        """
+        n_lanes = len(self.urls) * streams_per_url
+        if max_in_flight is None:
+            max_in_flight = 2 * n_lanes
+        collector = ReplyCollector(chunk_duration, verbose=verbose, columnar=columnar)
+        requests = RequestStream(list_of_files, models, model_version,
+                                 max_in_flight=max_in_flight,
+                                 decode_workers=decode_workers,
+                                 ordered=ordered,
+                                 chunk_duration=chunk_duration,
+                                 cache=cache,
+                                 on_cached=collector.add,
+                                 progress=verbose)
+        lock = threading.Lock()
+        replies = queue.Queue()
+        lanes = [_Lane(magcil_api_pb2_grpc.AudioModelsPredictStub(self.channel(url, i)))
+                 for url in self.urls for i in range(streams_per_url)]
+        for lane in lanes:
+            threading.Thread(target=_read_lane, args=(lane, lock, replies),
+                             daemon=True).start()
+        threading.Thread(target=_dispatch, args=(iter(requests), lanes, lock, replies),
+                         daemon=True).start()
+        try:
+            remaining = len(lanes)
+            while remaining:
+                response = replies.get()
+                if response is None:
+                    remaining -= 1
+                elif isinstance(response, Exception):
+                    requests.check()
+                    raise response
+                else:
+                    collector.add(requests.done(response))
+        finally:
+            requests.close()
+            for lane in lanes:
+                lane.call.cancel()
+        requests.check()
+        collector.finish()
+        durations = dict(zip(requests.filenames, requests.durations))
+        dict_responses = dict(zip(collector.filenames, collector.dict_responses))
+        return collector.responses, durations, dict_responses
+
+
+def run(models, list_of_files, token, username, model_version="", url='localhost:50051',
+        root_certificates=None, private_key=None, certificate_chain=None, **kwargs):
+    """Returns (responses, durations, dict_responses) of all files.
+
+    durations and dict_responses are in the order the files were sent,
+    which is the input order unless ordered=False; responses are in
+    arrival order. Opens a one-off session; use a ClientSession to reuse channels across
+    calls. See RequestStream for the decoding and caching options in
+    kwargs. With columnar=True, dict_responses hold
+    {model: results.ModelPredictions} instead of one dict per window.
+    """
+    with ClientSession(token, username, [url], root_certificates, private_key,
+                       certificate_chain) as session:
+        return session.run(models, list_of_files, model_version, **kwargs)
+
+
+def run_fanout(models, list_of_files, token, username, model_version="",
+               urls=('localhost:50051',), root_certificates=None, private_key=None,
+               certificate_chain=None, **kwargs):
+    """Opens a one-off session and runs ClientSession.run_fanout() on it."""
+    with ClientSession(token, username, urls, root_certificates, private_key,
+                       certificate_chain) as session:
+        return session.run_fanout(models, list_of_files, model_version, **kwargs)
 
 
 if __name__ == '__main__':
@@ -106,38 +597,63 @@ if __name__ == '__main__':
         default="",
         help='Version of model. Default is to use latest version.')
     parser.add_argument('-u',
-                        '--url',
+                        '--url', nargs='+',
                         type=str,
                         required=False,
-                        default='localhost:50051',
-                        help='Inference server URL. Default is localhost:8000.')
+                        default=['localhost:50051'],
+                        help='Inference server URL(s). Default is localhost:50051.')
     parser.add_argument('-i',
                         '--input',
                         type=str,
                         nargs='?',
                         default=None,
                         help='Input audio / Input folder.')
+    parser.add_argument(
+        '-l',
+        '--file_list',
+        type=str,
+        required=False,
+        default=None,
+        help='File listing the input files one per line, or - to read them '
+             'from stdin. Replaces --input.')
+    parser.add_argument(
+        '-r',
+        '--recursive',
+        action='store_true',
+        help='Also send the audio files in the subfolders of the input folder.')
+    parser.add_argument(
+        '--extensions',
+        nargs='+',
+        type=str,
+        required=False,
+        default=list(AUDIO_EXTENSIONS),
+        help='Extensions of the audio files to send from the input folder. '
+             'Default is the common audio formats.')
+    parser.add_argument(
+        '--largest_first',
+        action='store_true',
+        help='Send the files of the input folder by decreasing size.')
     parser.add_argument(
         '-rc',
         '--root_certificates',
         type=str,
         required=False,
         default=None,
-        help='File holding PEM-encoded root certificates. Default is None.')
+        help='File holding PEM-encoded root certificates. Default is ssl_keys/ca.crt.')
     parser.add_argument(
         '-pk',
         '--private_key',
         type=str,
         required=False,
         default=None,
-        help='File holding PEM-encoded private key. Default is None.')
+        help='File holding PEM-encoded private key. Default is ssl_keys/client.key.')
     parser.add_argument(
         '-cc',
         '--certificate_chain',
         type=str,
         required=False,
         default=None,
-        help='File holding PEM-encoded certicate chain. Default is None.')
+        help='File holding PEM-encoded certicate chain. Default is ssl_keys/client.crt.')
     parser.add_argument(
         '-t',
         '--token',
@@ -149,27 +665,136 @@ if __name__ == '__main__':
         type=str,
         required=True,
         help='Username')
+    parser.add_argument(
+        '--max_in_flight',
+        type=int,
+        required=False,
+        default=2,
+        help='Maximum number of decoded files waiting for predictions, per stream. Default is 2.')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of processes decoding audio files. Default is 1.')
+    parser.add_argument(
+        '--unordered',
+        action='store_true',
+        help='Send files as soon as they are decoded instead of in input order.')
+    parser.add_argument(
+        '-c',
+        '--chunk_duration',
+        type=int,
+        required=False,
+        default=None,
+        help='Split files into requests of this many seconds (a multiple of '
+             'the model step). Default is to send each file whole.')
+    parser.add_argument(
+        '-s',
+        '--streams',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of parallel streams to open to each URL. Default is 1.')
+    parser.add_argument(
+        '--cache',
+        type=str,
+        required=False,
+        default=None,
+        help='SQLite file caching predictions, so that unchanged files are '
+             'not sent again. Default is no cache.')
+    parser.add_argument(
+        '--cache_size',
+        type=int,
+        required=False,
+        default=1024,
+        help='Maximum size of the prediction cache in MB. Default is 1024.')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only process the files of the input folder that are new or '
+             'changed since they were last processed.')
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep watching the input folder and process new or changed files '
+             'as they arrive (implies --incremental).')
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        required=False,
+        default=None,
+        help='SQLite file recording the processed files. Default is '
+             '.manifest.db in the input folder.')
+    parser.add_argument(
+        '--interval',
+        type=float,
+        required=False,
+        default=5.0,
+        help='Seconds between two scans of the watched folder. Default is 5.')
 
 
     FLAGS = parser.parse_args()
+    if (FLAGS.incremental or FLAGS.watch) and (
+            FLAGS.chunk_duration or FLAGS.streams > 1 or len(FLAGS.url) > 1):
+        parser.error('--incremental and --watch take a single -u and no -c or -s')
 
-    if os.path.isfile(FLAGS.input) or os.path.isdir(FLAGS.input):
-        input_files = FLAGS.input
-        if os.path.isfile(input_files):
-            list_of_files = [input_files]
-        else:
-            list_of_files = []
-            list_names = os.listdir(input_files)
-            for filename in list_names:
-                f = os.path.join(input_files, filename)
-                list_of_files.append(f)
+    if FLAGS.file_list is not None:
+        list_of_files = read_file_list(sys.stdin if FLAGS.file_list == '-' else FLAGS.file_list)
+    elif FLAGS.input is not None and os.path.isfile(FLAGS.input):
+        list_of_files = [FLAGS.input]
+    elif FLAGS.input is not None and os.path.isdir(FLAGS.input):
+        list_of_files = discover(FLAGS.input, recursive=FLAGS.recursive,
+                                 extensions=FLAGS.extensions,
+                                 largest_first=FLAGS.largest_first)
     else:
         raise Exception("No such file or directory")
 
-    _, _, _ = run(
-        FLAGS.model, list_of_files, FLAGS.token, FLAGS.username, FLAGS.model_version, FLAGS.url,
-        root_certificates=FLAGS.root_certificates,
-        private_key=FLAGS.private_key,
-        certificate_chain=FLAGS.certificate_chain
-    )
+    cache = None
+    if FLAGS.cache:
+        cache = PredictionCache(FLAGS.cache, max_size=FLAGS.cache_size * 2 ** 20)
 
+    try:
+        if FLAGS.incremental or FLAGS.watch:
+            if FLAGS.input is None or not os.path.isdir(FLAGS.input):
+                sys.exit('--incremental and --watch need an input folder')
+            manifest = Manifest(FLAGS.manifest or os.path.join(FLAGS.input, '.manifest.db'))
+            watcher = FolderWatcher(FLAGS.input, manifest, watch=FLAGS.watch,
+                                    interval=FLAGS.interval, recursive=FLAGS.recursive,
+                                    extensions=FLAGS.extensions)
+            with ClientSession(FLAGS.token, FLAGS.username, FLAGS.url,
+                               FLAGS.root_certificates, FLAGS.private_key,
+                               FLAGS.certificate_chain) as session:
+                session.watch(FLAGS.model, watcher, FLAGS.model_version,
+                              max_in_flight=FLAGS.max_in_flight,
+                              decode_workers=FLAGS.workers,
+                              ordered=not FLAGS.unordered,
+                              cache=cache)
+        elif len(FLAGS.url) == 1 and FLAGS.streams == 1:
+            _, _, _ = run(
+                FLAGS.model, list_of_files, FLAGS.token, FLAGS.username, FLAGS.model_version, FLAGS.url[0],
+                root_certificates=FLAGS.root_certificates,
+                private_key=FLAGS.private_key,
+                certificate_chain=FLAGS.certificate_chain,
+                max_in_flight=FLAGS.max_in_flight,
+                decode_workers=FLAGS.workers,
+                ordered=not FLAGS.unordered,
+                chunk_duration=FLAGS.chunk_duration,
+                cache=cache
+            )
+        else:
+            _, _, _ = run_fanout(
+                FLAGS.model, list_of_files, FLAGS.token, FLAGS.username, FLAGS.model_version,
+                urls=FLAGS.url, streams_per_url=FLAGS.streams,
+                root_certificates=FLAGS.root_certificates,
+                private_key=FLAGS.private_key,
+                certificate_chain=FLAGS.certificate_chain,
+                max_in_flight=FLAGS.max_in_flight * len(FLAGS.url) * FLAGS.streams,
+                decode_workers=FLAGS.workers,
+                ordered=not FLAGS.unordered,
+                chunk_duration=FLAGS.chunk_duration,
+                cache=cache
+            )
+    except ConnectionError as e:
+        sys.exit(str(e))
@@ -0,0 +1,83 @@
+"Discovery of the audio files to send: recursive folder walks, filtering and file lists"
+import os
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.oga', '.opus',
+                    '.m4a', '.aac', '.aif', '.aiff', '.au', '.wma', '.webm')
+
+
+def sniff_audio(path):
+    """Returns whether the header of path looks like a known audio container."""
+    try:
+        with open(path, 'rb') as fh:
+            header = fh.read(12)
+    except OSError:
+        return False
+    if len(header) < 4:
+        return False
+    return (header[:4] in (b'RIFF', b'RIFX', b'fLaC', b'OggS', b'.snd', b'FORM')
+            or header[:3] == b'ID3'
+            # MPEG audio / ADTS frame sync
+            or (header[0] == 0xFF and header[1] & 0xE0 == 0xE0)
+            # MP4 / M4A
+            or header[4:8] == b'ftyp'
+            # Matroska / WebM
+            or header[:4] == b'\x1a\x45\xdf\xa3'
+            # ASF (wma)
+            or header[:4] == b'\x30\x26\xb2\x75')
+
+
+def is_audio(path, extensions=AUDIO_EXTENSIONS, sniff=True):
+    if extensions and not path.lower().endswith(tuple(extensions)):
+        return False
+    return not sniff or sniff_audio(path)
+
+
+def walk(folder, recursive=True):
+    """Yields the os.DirEntry of every file under folder, skipping hidden
+    entries. Only the paths of the directories still to visit are kept in
+    memory."""
+    stack = [folder]
+    while stack:
+        subfolders = []
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if recursive:
+                        subfolders.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+        stack.extend(reversed(subfolders))
+
+
+def discover(folder, recursive=True, extensions=AUDIO_EXTENSIONS, sniff=True,
+             largest_first=False):
+    """Yields the paths of the audio files under folder.
+
+    With largest_first, files are yielded by decreasing size, which packs
+    the decode/inference pipeline better; this needs the (size, path) of
+    every file in memory, whereas by default paths are yielded as found.
+    """
+    entries = (entry for entry in walk(folder, recursive)
+               if is_audio(entry.path, extensions, sniff))
+    if not largest_first:
+        for entry in entries:
+            yield entry.path
+        return
+    for _, path in sorted(((entry.stat().st_size, entry.path) for entry in entries),
+                          reverse=True):
+        yield path
+
+
+def read_file_list(source):
+    """Yields the paths listed one per line in source, an open file or the
+    path of a file list. Empty lines and lines starting with # are skipped."""
+    if isinstance(source, str):
+        with open(source) as fh:
+            yield from read_file_list(fh)
+        return
+    for line in source:
+        path = line.strip()
+        if path and not path.startswith('#'):
+            yield path
@@ -0,0 +1,233 @@
+"Streams the audio of media files and YouTube links as 8 kHz mono PCM through one ffmpeg process"
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+
+FFMPEG = os.environ.get('FFMPEG', 'ffmpeg')
+
+
+def is_link(source):
+    return source.startswith(('http://', 'https://')) and not os.path.exists(source)
+
+
+def resolve(source):
+    """Returns (media url or path, http headers, title) of a link or local file.
+
+    Links are resolved with youtube_dl to the url of their best audio stream,
+    without downloading anything.
+    """
+    if not is_link(source):
+        return source, None, os.path.basename(source)
+    import youtube_dl
+    with youtube_dl.YoutubeDL({'format': 'bestaudio/best', 'quiet': True}) as ydl:
+        try:
+            info = ydl.extract_info(source, download=False)
+        except youtube_dl.utils.DownloadError as e:
+            raise RuntimeError(f"cannot resolve {source}: {e}") from e
+    return info['url'], info.get('http_headers'), info.get('title')
+
+
+def open_pcm(source, sr=8000, ffmpeg=FFMPEG):
+    """Starts one ffmpeg process that downloads (for links) and decodes source,
+    writing sr Hz mono s16le PCM to its stdout as it goes."""
+    url, headers, _ = resolve(source)
+    cmd = [ffmpeg, '-nostdin', '-loglevel', 'error']
+    if headers:
+        cmd += ['-headers', ''.join(f"{key}: {value}\r\n" for key, value in headers.items())]
+    cmd += ['-i', url, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+            '-ac', '1', '-ar', str(sr), 'pipe:1']
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _ffmpeg_failed(source, stderr):
+    raise RuntimeError(f"ffmpeg failed on {source}: {stderr.decode(errors='replace').strip()}")
+
+
+def iter_pcm_chunks(source, chunk_duration, sr=8000):
+    """Yields consecutive (data, dimension, fs) chunks of chunk_duration seconds
+    of a link or local media file, like audio_io.iter_chunks.
+
+    Chunks are read from ffmpeg's stdout as soon as they are decoded, so the
+    first requests are sent while the rest is still being downloaded, and
+    nothing is written to disk.
+    """
+    chunk_bytes = 2 * int(chunk_duration * sr)
+    proc = open_pcm(source, sr)
+    try:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            yield data, (len(data) // 2,), sr
+        if proc.wait() != 0:
+            _ffmpeg_failed(source, proc.stderr.read())
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def download(source, folder):
+    """Downloads the best audio stream of a link into folder, in a single
+    youtube_dl pass and without re-encoding. Returns (path, title); local
+    files are returned as they are."""
+    if not is_link(source):
+        return source, os.path.basename(source)
+    import youtube_dl
+    opts = {'format': 'bestaudio/best', 'quiet': True, 'noprogress': True,
+            'outtmpl': os.path.join(folder, 'audio.%(ext)s')}
+    with youtube_dl.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(source, download=True)
+        return ydl.prepare_filename(info), info.get('title')
+
+
+def transcode(path, sr=8000):
+    """Decodes a local media file to sr Hz mono s16le bytes with one ffmpeg process."""
+    proc = open_pcm(path, sr)
+    data, stderr = proc.communicate()
+    if proc.returncode != 0:
+        _ffmpeg_failed(path, stderr)
+    return data
+
+
+def iter_buffer_chunks(data, chunk_duration, sr=8000):
+    """Yields (data, dimension, fs) chunks of chunk_duration seconds of
+    in-memory s16le PCM, like audio_io.iter_chunks."""
+    chunk_bytes = 2 * int(chunk_duration * sr)
+    for offset in range(0, len(data), chunk_bytes):
+        chunk = data[offset:offset + chunk_bytes]
+        yield chunk, (len(chunk) // 2,), sr
+
+
+def _stage(func, inbox, outbox, workers, stop, fatal):
+    """Runs func on the items of inbox with `workers` threads, putting the
+    results in outbox. Items that already failed are passed through, and
+    exceptions are recorded in the item. A ConnectionError (or any
+    non-Exception) is fatal: it is appended to fatal and sets stop, after
+    which the remaining items are passed through without running func.
+    Ends outbox with None once inbox has ended and every worker is done,
+    whatever happened."""
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def work():
+        try:
+            for item in iter(inbox.get, None):
+                if stop.is_set():
+                    # nobody may be left to clean up after this item
+                    shutil.rmtree(item.pop('folder', None) or '', ignore_errors=True)
+                    if item.get('error') is None:
+                        item['error'] = "cancelled"
+                if item.get('error') is None:
+                    try:
+                        func(item)
+                    except ConnectionError as e:
+                        fatal.append(e)
+                        stop.set()
+                        item['error'] = str(e)
+                    except Exception as e:
+                        logging.warning("%s failed: %s", item['input'], e)
+                        item['error'] = str(e)
+                    except BaseException as e:
+                        fatal.append(e)
+                        stop.set()
+                        item['error'] = repr(e)
+                outbox.put(item)
+        finally:
+            # let the other workers of the stage see the end too
+            inbox.put(None)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                outbox.put(None)
+
+    for _ in range(workers):
+        threading.Thread(target=work, daemon=True).start()
+
+
+def run_batch(session, models, sources, model_version="", chunk_duration=10.0,
+              download_workers=4, transcode_workers=2, infer_workers=4,
+              queue_size=4, tmp_dir=None, columnar=False):
+    """Runs links and local media files through download, transcode and
+    inference stages, each with its own worker threads.
+
+    The stages are connected by queues of queue_size items, so at most a few
+    items are downloaded or decoded ahead of inference. Every download goes
+    to its own temporary folder, removed once it is transcoded. Inference
+    uses the warm channels of session (a client.ClientSession), one Predict
+    stream per item.
+
+    Yields dicts with the input, title, duration and predictions
+    ({model: [{"st", "et", "class"}, ...]}, or {model: results.ModelPredictions}
+    if columnar) of every item as it completes, or with its error if a stage
+    failed. Errors that affect every item, such as a server that cannot be
+    reached or a list of sources that cannot be read, stop the pipeline and
+    are raised.
+    """
+    sources = iter(sources)
+    downloads = queue.Queue(queue_size)
+    transcodes = queue.Queue(queue_size)
+    inferences = queue.Queue(queue_size)
+    results = queue.Queue()
+    stop = threading.Event()
+    fatal = []
+
+    def feed():
+        try:
+            for source in sources:
+                if stop.is_set():
+                    break
+                downloads.put({'input': source, 'error': None})
+        except BaseException as e:
+            fatal.append(e)
+            stop.set()
+        finally:
+            downloads.put(None)
+
+    def do_download(item):
+        item['folder'] = tempfile.mkdtemp(prefix='clients_api_', dir=tmp_dir)
+        item['path'], item['title'] = download(item['input'], item['folder'])
+
+    def do_transcode(item):
+        try:
+            item['audio'] = transcode(item['path'])
+        finally:
+            shutil.rmtree(item.pop('folder'), ignore_errors=True)
+
+    def do_infer(item):
+        audio = item.pop('audio')
+        if not audio:
+            raise RuntimeError("no audio was decoded")
+        item['duration'] = len(audio) / 2 / 8000
+        _, _, dict_responses = session.run(
+            models, [item['input']], model_version, chunk_duration=chunk_duration,
+            chunker=lambda name, duration, sr=8000: iter_buffer_chunks(audio, duration, sr),
+            columnar=columnar, verbose=False)
+        item['predictions'] = dict_responses[0]
+
+    threading.Thread(target=feed, daemon=True).start()
+    _stage(do_download, downloads, transcodes, download_workers, stop, fatal)
+    _stage(do_transcode, transcodes, inferences, transcode_workers, stop, fatal)
+    _stage(do_infer, inferences, results, infer_workers, stop, fatal)
+    try:
+        for item in iter(results.get, None):
+            folder = item.pop('folder', None)
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+            item.pop('audio', None)
+            item.pop('path', None)
+            if fatal:
+                raise fatal[0]
+            yield item
+        if fatal:
+            raise fatal[0]
+    finally:
+        # the stages drain without doing any more work
+        stop.set()
@@ -0,0 +1,392 @@
+"Streaming of live audio blocks to the Deep Audio API over one long-lived Predict stream"
+import collections
+import queue
+import threading
+import time
+from datetime import datetime
+
+import grpc
+import numpy as np
+
+import magcil_api_pb2
+
+# AudioRequest.filename of a multiplexed window is <stream id><STREAM_SEPARATOR><sequence number>
+STREAM_SEPARATOR = '@'
+DROP_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+
+class RingBuffer:
+    """Preallocated int16 ring buffer of the last `capacity` captured samples.
+
+    A capture callback write()s into it while the inference side reads
+    windows from it concurrently. Samples are addressed by their absolute
+    position since the start of the capture.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self._written = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def written(self):
+        return self._written
+
+    def write(self, samples):
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+        with self._cond:
+            start = (self._written + n - len(samples)) % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._buf[start:start + first] = samples[:first]
+            self._buf[:len(samples) - first] = samples[first:]
+            self._written += n
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def wait_for(self, end, timeout=None):
+        """Waits until sample end has been written; returns False if the
+        buffer was closed (or timed out) before that."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._written >= end or self._closed, timeout) and self._written >= end
+
+    def read(self, start, n):
+        """Returns a copy of samples [start, start + n), or None if some of
+        them have already been overwritten."""
+        with self._cond:
+            if start < self._written - self.capacity or start + n > self._written:
+                return None
+            first = start % self.capacity
+            if first + n <= self.capacity:
+                return self._buf[first:first + n].copy()
+            return np.concatenate((self._buf[first:], self._buf[:first + n - self.capacity]))
+
+    def read_bytes(self, start, n):
+        """Like read(), but returns the little-endian int16 bytes of the
+        samples, copied once straight out of the buffer."""
+        with self._cond:
+            if start < self._written - self.capacity or start + n > self._written:
+                return None
+            first = start % self.capacity
+            if first + n <= self.capacity:
+                return self._buf[first:first + n].tobytes()
+            return b''.join((self._buf[first:].data,
+                             self._buf[:first + n - self.capacity].data))
+
+
+def iter_windows(ring, window, hop):
+    """Yields (start, data, captured_at) for sliding windows of `window`
+    samples every `hop` samples, as soon as each window has been captured.
+    data holds the int16 bytes of the window, ready for AudioRequest.data.
+
+    If the consumer falls more than the ring capacity behind, the windows
+    that were overwritten are skipped. Returns when the ring is closed.
+    """
+    start = 0
+    while ring.wait_for(start + window):
+        captured_at = time.time()
+        data = ring.read_bytes(start, window)
+        if data is None:
+            # overrun: jump to the most recent complete window
+            start += max(hop, (ring.written - window - start) // hop * hop)
+            continue
+        yield start, data, captured_at
+        start += hop
+
+
+class RealTimeStream:
+    """Sends audio blocks down one long-lived Predict stream.
+
+    send() queues the request of a block (typically from a capture thread)
+    and gRPC pulls it through a queue-backed request iterator, so blocks are
+    pipelined instead of paying one call per block. replies() yields every
+    reply with its end-to-end latency, from the capture of its block to the
+    arrival of its predictions. At most max_pending blocks wait to be sent;
+    send() blocks when the server falls that far behind.
+    """
+    def __init__(self, stub, models, model_version="", fs=8000, max_pending=16):
+        self.models = models
+        self.model_version = model_version
+        self.fs = fs
+        self._queue = queue.Queue(max_pending)
+        self._captured = {}
+        self._lock = threading.Lock()
+        self._call = stub.Predict(iter(self._queue.get, None))
+
+    def send(self, filename, data, dimension=None, captured_at=None):
+        """Queues int16 bytes data (of dimension samples) for prediction."""
+        if dimension is None:
+            dimension = (len(data) // 2,)
+        with self._lock:
+            self._captured[filename] = captured_at or time.time()
+        self._queue.put(magcil_api_pb2.AudioRequest(
+            filename=filename, dimension=dimension,
+            data=data, fs=self.fs, models=self.models,
+            model_version=self.model_version))
+
+    def replies(self):
+        """Yields (response, latency in seconds) as the replies arrive."""
+        for response in self._call:
+            with self._lock:
+                captured_at = self._captured.pop(response.filename, None)
+            latency = time.time() - captured_at if captured_at is not None else None
+            yield response, latency
+
+    def close(self):
+        """Ends the request stream; replies() returns after the last reply."""
+        self._queue.put(None)
+
+    def cancel(self):
+        self._call.cancel()
+
+
+def stream_source(stub, source, models, model_version="", window=1.0, hop=None,
+                  buffer_duration=10.0):
+    """Runs an audio_sources.AudioSource through a ring buffer and sliding
+    windows of `window` seconds every `hop` seconds (default `window`) into
+    one RealTimeStream.
+
+    Yields (response, latency) until the source is exhausted.
+    """
+    fs = source.fs
+    window_size = int(fs * window)
+    hop_size = int(fs * hop) if hop else window_size
+    ring = RingBuffer(int(fs * buffer_duration))
+    rt_stream = RealTimeStream(stub, models, model_version, fs)
+
+    def send_windows():
+        try:
+            for count, (start, data, captured_at) in enumerate(
+                    iter_windows(ring, window_size, hop_size)):
+                now = datetime.now()
+                dt_string = now.strftime("%Y_%m_%d__%H_%M_%S")
+                filename = f"{dt_string}_{count + 1}.wav"
+                rt_stream.send(filename, data, (window_size,), captured_at)
+        finally:
+            rt_stream.close()
+
+    source.start(ring)
+    threading.Thread(target=send_windows, daemon=True).start()
+    try:
+        for response, latency in rt_stream.replies():
+            yield response, latency
+    finally:
+        source.stop()
+        ring.close()
+
+
+class LiveFeed:
+    """One live feed multiplexed by a StreamManager.
+
+    submit() hands over a window of int16 bytes; at most max_in_flight
+    windows of the feed are outstanding at the server and up to max_pending
+    more wait in the feed. When that is full because the server falls
+    behind, the drop policy either blocks the producer ('block'), discards
+    the oldest waiting window ('drop_oldest', the default, which keeps the
+    predictions current) or discards the new one ('drop_newest').
+    """
+    def __init__(self, manager, stream_id, lane, models, model_version, fs,
+                 max_in_flight, max_pending, drop):
+        if drop not in DROP_POLICIES:
+            raise ValueError(f"drop must be one of {DROP_POLICIES}, not {drop!r}")
+        self.stream_id = stream_id
+        self.models = models
+        self.model_version = model_version
+        self.fs = fs
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.drop = drop
+        self.sent = 0
+        self.dropped = 0
+        self._manager = manager
+        self._lane = lane
+        self._seq = 0
+        self._in_flight = 0
+        self._pending = collections.deque()
+        self._captured = {}
+        self._closed = False
+        self._replies = queue.Queue()
+
+    def submit(self, data, dimension=None, captured_at=None):
+        """Queues a window for prediction and returns its sequence number,
+        or None if the window was dropped."""
+        if dimension is None:
+            dimension = (len(data) // 2,)
+        cond = self._manager._cond
+        with cond:
+            seq = self._seq
+            self._seq += 1
+            request = magcil_api_pb2.AudioRequest(
+                filename=f"{self.stream_id}{STREAM_SEPARATOR}{seq}",
+                dimension=dimension, data=data, fs=self.fs, models=self.models,
+                model_version=self.model_version)
+            self._captured[seq] = captured_at or time.time()
+            if self.drop == 'block':
+                cond.wait_for(lambda: self._in_flight < self.max_in_flight
+                              or len(self._pending) < self.max_pending
+                              or self._lane.error is not None)
+            if self._in_flight < self.max_in_flight:
+                self._send(request)
+                return seq
+            if len(self._pending) >= self.max_pending:
+                if self.drop == 'drop_oldest' and self._pending:
+                    dropped = self._pending.popleft()
+                    self._captured.pop(int(dropped.filename.rpartition(STREAM_SEPARATOR)[2]), None)
+                else:
+                    del self._captured[seq]
+                    self.dropped += 1
+                    return None
+                self.dropped += 1
+            self._pending.append(request)
+            return seq
+
+    def _send(self, request):
+        self._in_flight += 1
+        self.sent += 1
+        self._lane.queue.put(request)
+
+    def _on_reply(self, seq, response):
+        # called with the manager's lock held
+        self._in_flight -= 1
+        if self._pending:
+            self._send(self._pending.popleft())
+        self._manager._cond.notify_all()
+        captured_at = self._captured.pop(seq, None)
+        latency = time.time() - captured_at if captured_at is not None else None
+        self._replies.put((seq, response, latency))
+        self._check_done()
+
+    def _check_done(self):
+        if self._closed and not self._in_flight and not self._pending:
+            self._replies.put(None)
+            self._manager._feed_done(self)
+
+    def close(self):
+        """No more windows will be submitted; replies() returns after the
+        reply of the last window sent."""
+        with self._manager._cond:
+            if not self._closed:
+                self._closed = True
+                self._check_done()
+
+    def replies(self):
+        """Yields (sequence number, response, latency in seconds) of the
+        feed's windows in the order of their replies."""
+        for item in iter(self._replies.get, None):
+            yield item
+        if self._lane.error is not None:
+            raise self._lane.error
+
+
+class _FeedLane:
+    """One Predict stream shared by the feeds assigned to it."""
+    def __init__(self, stub):
+        self.queue = queue.Queue()
+        self.feeds = {}
+        self.error = None
+        self.call = stub.Predict(iter(self.queue.get, None))
+
+
+class StreamManager:
+    """Multiplexes many live feeds onto a few long-lived Predict streams.
+
+    Every feed is pinned to the stream with the fewest feeds when it is
+    opened, so its replies arrive in order, and each reply is routed back to
+    its feed by the stream id and sequence number tagged in the request's
+    filename. Feeds may use different models.
+
+        manager = StreamManager(stub, streams=2)
+        feed = manager.add_source("cam1", source, ["4_class"], window=1.0)
+        for seq, response, latency in feed.replies():
+            ...
+        manager.close()
+    """
+    def __init__(self, stub, streams=1, max_in_flight=2, max_pending=4, drop='drop_oldest'):
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.drop = drop
+        self._cond = threading.Condition()
+        self._lanes = [_FeedLane(stub) for _ in range(streams)]
+        for lane in self._lanes:
+            threading.Thread(target=self._read, args=(lane,), daemon=True).start()
+
+    def open(self, stream_id, models, model_version="", fs=8000, max_in_flight=None,
+             max_pending=None, drop=None):
+        """Opens a feed whose windows are submitted by the caller."""
+        if STREAM_SEPARATOR in stream_id:
+            raise ValueError(f"stream id must not contain {STREAM_SEPARATOR!r}")
+        with self._cond:
+            if any(stream_id in lane.feeds for lane in self._lanes):
+                raise ValueError(f"stream {stream_id!r} is already open")
+            lane = min(self._lanes, key=lambda lane: len(lane.feeds))
+            feed = LiveFeed(self, stream_id, lane, models, model_version, fs,
+                            max_in_flight or self.max_in_flight,
+                            self.max_pending if max_pending is None else max_pending,
+                            drop or self.drop)
+            lane.feeds[stream_id] = feed
+        return feed
+
+    def add_source(self, stream_id, source, models, model_version="", window=1.0,
+                   hop=None, buffer_duration=10.0, **kwargs):
+        """Opens a feed fed by the sliding windows of an
+        audio_sources.AudioSource; the feed is closed when the source ends."""
+        fs = source.fs
+        window_size = int(fs * window)
+        hop_size = int(fs * hop) if hop else window_size
+        ring = RingBuffer(int(fs * buffer_duration))
+        feed = self.open(stream_id, models, model_version, fs, **kwargs)
+
+        def send_windows():
+            try:
+                for start, data, captured_at in iter_windows(ring, window_size, hop_size):
+                    feed.submit(data, (window_size,), captured_at)
+                    if feed._lane.error is not None:
+                        break
+            finally:
+                source.stop()
+                ring.close()
+                feed.close()
+
+        source.start(ring)
+        threading.Thread(target=send_windows, daemon=True).start()
+        return feed
+
+    def _read(self, lane):
+        try:
+            for response in lane.call:
+                stream_id, _, seq = response.filename.rpartition(STREAM_SEPARATOR)
+                with self._cond:
+                    feed = lane.feeds.get(stream_id)
+                    if feed is not None:
+                        feed._on_reply(int(seq), response)
+        except grpc.RpcError as e:
+            with self._cond:
+                lane.error = e
+                for feed in list(lane.feeds.values()):
+                    feed._replies.put(None)
+                self._cond.notify_all()
+
+    def _feed_done(self, feed):
+        feed._lane.feeds.pop(feed.stream_id, None)
+
+    def stats(self):
+        """Returns {stream id: (windows sent, windows dropped)} of the open feeds."""
+        with self._cond:
+            return {feed.stream_id: (feed.sent, feed.dropped)
+                    for lane in self._lanes for feed in lane.feeds.values()}
+
+    def close(self):
+        """Ends the Predict streams; call once every feed has finished."""
+        for lane in self._lanes:
+            lane.queue.put(None)
+
+    def cancel(self):
+        for lane in self._lanes:
+            lane.call.cancel()
@@ -0,0 +1,79 @@
+"Columnar, NumPy-backed representation of the predictions in MagCilReplies"
+import numpy as np
+
+
+class ModelPredictions:
+    """Predictions of one model over the windows of one file.
+
+    pred holds the class index of every window, labels the class label
+    table and st the start time (in seconds) of every window; all windows
+    last step seconds.
+    """
+    __slots__ = ('model_name', 'step', 'pred', 'labels', 'st')
+
+    def __init__(self, model_name, step, pred, labels, st=None, offset=0):
+        self.model_name = model_name
+        self.step = step
+        self.pred = pred
+        self.labels = labels
+        if st is None:
+            st = offset + np.arange(len(pred), dtype=np.int64) * step
+        self.st = st
+
+    @property
+    def et(self):
+        return self.st + self.step
+
+    @property
+    def classes(self):
+        """Label of every window, as an array of strings."""
+        return np.asarray(self.labels)[self.pred]
+
+    def __len__(self):
+        return len(self.pred)
+
+    def __repr__(self):
+        return "ModelPredictions(%r, step=%r, windows=%d, labels=%r)" % (
+            self.model_name, self.step, len(self.pred), list(self.labels))
+
+    def to_dicts(self):
+        """Compatibility view: one {"st", "et", "class"} dict per window."""
+        labels = list(self.labels)
+        return [{"st": st, "et": st + self.step, "class": labels[pred]}
+                for st, pred in zip(self.st.tolist(), self.pred.tolist())]
+
+
+def decode_reply(response, offset=0):
+    """Converts a MagCilReply to {model: ModelPredictions}.
+
+    offset (in seconds) is added to all window start times.
+    """
+    decoded = {}
+    for i, model_name in enumerate(response.model_name):
+        p = response.preds[i].p
+        pred = np.fromiter(p, dtype=np.int32, count=len(p))
+        decoded[model_name] = ModelPredictions(
+            model_name, response.step[i], pred, tuple(response.classes[i].cl),
+            offset=offset)
+    return decoded
+
+
+def concatenate(parts):
+    """Joins consecutive ModelPredictions of the same model into one.
+
+    Class indices are remapped if the parts do not share a label table.
+    """
+    first = parts[0]
+    labels = list(first.labels)
+    preds = []
+    for part in parts:
+        if tuple(part.labels) == tuple(labels):
+            preds.append(part.pred)
+            continue
+        for label in part.labels:
+            if label not in labels:
+                labels.append(label)
+        remap = np.array([labels.index(label) for label in part.labels], dtype=np.int32)
+        preds.append(remap[part.pred])
+    return ModelPredictions(first.model_name, first.step, np.concatenate(preds),
+                            tuple(labels), st=np.concatenate([part.st for part in parts]))
@@ -0,0 +1,114 @@
+"Run-length segmentation of columnar predictions into compact arrays"
+import numpy as np
+
+from results import ModelPredictions
+
+
+class Segments:
+    """Runs of consecutive windows with the same class.
+
+    label holds the class index of every segment into the labels table, st
+    and et its start and end times (in seconds) and count its number of
+    windows, all as NumPy arrays.
+    """
+    __slots__ = ('model_name', 'labels', 'label', 'st', 'et', 'count')
+
+    def __init__(self, model_name, labels, label, st, et, count):
+        self.model_name = model_name
+        self.labels = labels
+        self.label = label
+        self.st = st
+        self.et = et
+        self.count = count
+
+    @property
+    def duration(self):
+        return self.et - self.st
+
+    @property
+    def classes(self):
+        """Label of every segment, as an array."""
+        labels = np.empty(len(self.labels), dtype=object)
+        for i, label in enumerate(self.labels):
+            labels[i] = label
+        return labels[self.label]
+
+    def __len__(self):
+        return len(self.label)
+
+    def __repr__(self):
+        return "Segments(%r, segments=%d, labels=%r)" % (
+            self.model_name, len(self.label), list(self.labels))
+
+    def __getitem__(self, index):
+        """Selects segments with a boolean mask, index array or slice."""
+        return Segments(self.model_name, self.labels, self.label[index],
+                        self.st[index], self.et[index], self.count[index])
+
+    def at(self, t):
+        """Index of the segment containing time t, or None."""
+        i = np.searchsorted(self.st, t, side='right') - 1
+        if i >= 0 and t <= self.et[i]:
+            return int(i)
+        return None
+
+    def to_dicts(self):
+        """One {"class", "st", "et", "windows"} dict per segment."""
+        return [{"class": label, "st": st, "et": et, "windows": count}
+                for label, st, et, count in zip(self.classes.tolist(), self.st.tolist(),
+                                                self.et.tolist(), self.count.tolist())]
+
+
+def find_segments(predictions, min_duration=0):
+    """Splits a results.ModelPredictions into Segments of consecutive
+    windows with the same class, keeping those lasting at least
+    min_duration seconds. A gap between windows also ends a segment."""
+    pred = predictions.pred
+    st = predictions.st
+    step = predictions.step
+    n = len(pred)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return Segments(predictions.model_name, predictions.labels,
+                        pred[:0], st[:0], st[:0] + step, empty)
+    changes = np.flatnonzero((pred[1:] != pred[:-1]) | (st[1:] - st[:-1] != step)) + 1
+    starts = np.concatenate(([0], changes))
+    ends = np.concatenate((changes, [n]))
+    segments = Segments(predictions.model_name, predictions.labels, pred[starts],
+                        st[starts], st[ends - 1] + step, ends - starts)
+    if min_duration:
+        segments = segments[segments.duration >= min_duration]
+    return segments
+
+
+def merge_models(predictions, min_duration=0):
+    """Segments the joint classes of several models.
+
+    predictions maps model names to results.ModelPredictions of the same
+    audio. They are resampled to the smallest step over the time covered by
+    all of them, and a segment ends whenever any model changes class. If
+    that time is empty (e.g. a model has no windows), no segments are
+    returned. The labels of the returned Segments are tuples with one label
+    per model.
+    """
+    models = list(predictions)
+    parts = [predictions[model] for model in models]
+    step = min(part.step for part in parts)
+    if all(len(part) for part in parts):
+        start = max(part.st[0] for part in parts)
+        end = min(part.et[-1] for part in parts)
+    else:
+        # a model without windows leaves no time covered by all of them
+        start = end = 0
+    grid = start + np.arange(max(0, int((end - start) // step)), dtype=np.int64) * step
+    # class of every model in every grid window
+    joint = np.stack([
+        part.pred[np.clip(np.searchsorted(part.st, grid, side='right') - 1, 0, None)]
+        if len(part) else np.zeros(0, dtype=np.int32)
+        for part in parts], axis=1)
+    combos, inverse = np.unique(joint, axis=0, return_inverse=True)
+    labels = tuple(tuple(part.labels[c] for part, c in zip(parts, combo))
+                   for combo in combos.tolist())
+    merged = ModelPredictions(tuple(models), step, inverse.reshape(-1).astype(np.int32),
+                              labels, st=grid)
+    return find_segments(merged, min_duration)
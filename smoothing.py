@@ -0,0 +1,47 @@
+"Sliding-window majority (mode) filtering of predicted class indices"
+import numpy as np
+
+from results import ModelPredictions
+
+
+def mode_filter(pred, size, n_classes=None):
+    """Replaces every class index of pred by the most frequent one in the
+    window of `size` predictions centered on it (truncated at the edges).
+
+    Ties keep the prediction of the window's center if it is among the most
+    frequent, else the lowest class index. Runs in O(n * n_classes) time
+    and O(n) memory: the count of each class in every window is the
+    difference of two entries of its cumulative sum.
+    """
+    pred = np.asarray(pred)
+    n = len(pred)
+    if n == 0 or size <= 1:
+        return pred.copy()
+    if n_classes is None:
+        n_classes = int(pred.max()) + 1
+    index = np.arange(n)
+    lo = np.maximum(index - size // 2, 0)
+    hi = np.minimum(index + size - size // 2, n)
+    best = np.zeros(n, dtype=np.int32)
+    best_count = np.zeros(n, dtype=np.int32)
+    own_count = np.zeros(n, dtype=np.int32)
+    cumsum = np.zeros(n + 1, dtype=np.int32)
+    for c in range(n_classes):
+        is_c = pred == c
+        np.cumsum(is_c, out=cumsum[1:])
+        count = cumsum[hi] - cumsum[lo]
+        better = count > best_count
+        best[better] = c
+        best_count[better] = count[better]
+        own_count[is_c] = count[is_c]
+    return np.where(own_count == best_count, pred, best).astype(pred.dtype)
+
+
+def smooth(predictions, size, passes=1):
+    """Returns a copy of a results.ModelPredictions with its class indices
+    mode filtered `passes` times."""
+    pred = predictions.pred
+    for _ in range(passes):
+        pred = mode_filter(pred, size, len(predictions.labels))
+    return ModelPredictions(predictions.model_name, predictions.step, pred,
+                            predictions.labels, st=predictions.st)
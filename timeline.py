@@ -0,0 +1,111 @@
+"Timeline plots of the predictions of several models, on screen or exported to PNG, SVG or HTML"
+import os
+
+import numpy as np
+
+from segments import find_segments
+
+
+def downsample(st, pred, width):
+    """Keeps one window per class per horizontal pixel of a plot `width`
+    pixels wide, which looks the same as plotting all of them."""
+    if len(st) <= width:
+        return st, pred
+    span = max(float(st[-1] - st[0]), 1e-9)
+    pixel = ((st - st[0]) * ((width - 1) / span)).astype(np.int64)
+    _, keep = np.unique(pixel * (int(pred.max()) + 1) + pred, return_index=True)
+    keep.sort()
+    return st[keep], pred[keep]
+
+
+def lanes(predictions):
+    """Returns [(model, predictions, base row)] of the stacked lanes of
+    {model: results.ModelPredictions}; class c of a model is drawn on row
+    base + c, with an empty row between lanes."""
+    stacked = []
+    base = 0
+    for model, model_predictions in predictions.items():
+        stacked.append((model, model_predictions, base))
+        base += len(model_predictions.labels) + 1
+    return stacked
+
+
+def draw(ax, predictions, min_duration=0, width=2000, height=0.6):
+    """Draws the predictions of every model in a lane of ax.
+
+    The segments of each class, at least min_duration seconds long, are
+    drawn as one broken bar collection, and the window predictions as one
+    scatter per model downsampled to `width` pixels, so the number of
+    artists does not grow with the duration. Returns {model: (segments.Segments,
+    base row)}.
+    """
+    ticks, tick_labels = [], []
+    drawn = {}
+    for model, model_predictions, base in lanes(predictions):
+        segments = find_segments(model_predictions, min_duration)
+        for c, label in enumerate(model_predictions.labels):
+            mask = segments.label == c
+            ax.broken_barh(np.column_stack((segments.st[mask], segments.duration[mask])),
+                           (base + c - height / 2, height),
+                           facecolors=f"C{c % 10}", alpha=0.6)
+            ticks.append(base + c)
+            tick_labels.append(f"{model}: {label}")
+        st, pred = downsample(model_predictions.st + model_predictions.step / 2,
+                              model_predictions.pred, width)
+        ax.scatter(st, base + pred, s=6, color="black")
+        drawn[model] = (segments, base)
+    ax.set_yticks(ticks)
+    ax.set_yticklabels(tick_labels)
+    # first model on top
+    ax.set_ylim(max(ticks, default=0) + 0.5, -0.5)
+    ax.set_xlabel("time (s)")
+    ax.set_facecolor("gainsboro")
+    ax.grid(True)
+    return drawn
+
+
+def figure_size(predictions, width=1600, dpi=100):
+    rows = sum(len(p.labels) + 1 for p in predictions.values())
+    return width / dpi, 1 + 0.4 * rows
+
+
+def export(predictions, path, min_duration=0, width=1600, title=None):
+    """Writes the timeline of {model: results.ModelPredictions} to path,
+    without a display: an interactive plotly page for .html, else a
+    matplotlib image in the format of the extension (.png, .svg, .pdf)."""
+    if os.path.splitext(path)[1].lower() in ('.html', '.htm'):
+        return export_html(predictions, path, min_duration, width, title)
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figure_size(predictions, width), dpi=100)
+    ax = fig.subplots()
+    draw(ax, predictions, min_duration, width)
+    if title:
+        ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def export_html(predictions, path, min_duration=0, width=1600, title=None):
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    rows = []
+    for model, model_predictions, base in lanes(predictions):
+        segments = find_segments(model_predictions, min_duration)
+        labels = [f"{model}: {label}" for label in model_predictions.labels]
+        rows.extend(labels)
+        for c, row in enumerate(labels):
+            mask = segments.label == c
+            fig.add_trace(go.Bar(
+                base=segments.st[mask], x=segments.duration[mask], y=[row] * int(mask.sum()),
+                customdata=segments.et[mask], orientation='h', name=row, opacity=0.6,
+                hovertemplate="%{base:.1f} - %{customdata:.1f} s<extra>" + row + "</extra>"))
+        st, pred = downsample(model_predictions.st + model_predictions.step / 2,
+                              model_predictions.pred, width)
+        fig.add_trace(go.Scattergl(
+            x=st, y=np.asarray(labels, dtype=object)[pred], mode='markers',
+            marker=dict(size=3, color="black"), name=f"{model} windows", showlegend=False))
+    fig.update_layout(title=title, width=width, height=int(100 * figure_size(predictions)[1]),
+                      barmode='overlay', xaxis_title="time (s)",
+                      yaxis=dict(categoryorder='array', categoryarray=rows,
+                                 autorange='reversed'))
+    fig.write_html(path, include_plotlyjs=True)
@@ -0,0 +1,141 @@
+"Incremental processing of an input folder: a manifest of processed files and a polling folder watcher"
+import hashlib
+import sqlite3
+import threading
+
+from discovery import AUDIO_EXTENSIONS, is_audio, walk
+
+
+def file_hash(path, block_size=2 ** 20):
+    h = hashlib.blake2b()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    """SQLite record of the processed files: path, size, mtime, content hash
+    and status ('processed', or 'failed' for files that could not be decoded)."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT, "
+            "status TEXT NOT NULL DEFAULT 'processed')")
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(files)")]
+        if 'status' not in columns:
+            # manifests written before failures were recorded
+            self._db.execute(
+                "ALTER TABLE files ADD COLUMN status TEXT NOT NULL DEFAULT 'processed'")
+        self._db.commit()
+
+    def get(self, path):
+        """Returns the (size, mtime, hash, status) recorded for path, or None."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT size, mtime, hash, status FROM files WHERE path = ?",
+                (path,)).fetchone()
+
+    def mark(self, path, size, mtime, content_hash, status='processed'):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                             (path, size, mtime, content_hash, status))
+            self._db.commit()
+
+    def failed(self):
+        """Returns the paths recorded as failed."""
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT path FROM files WHERE status = 'failed'")]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class FolderWatcher:
+    """Iterates over the files of folder that are new or changed since the
+    manifest recorded them.
+
+    Files whose size and mtime match the manifest are skipped without being
+    read; files with a new size or mtime are hashed, and skipped if their
+    content did not change. With watch, the folder is polled every interval
+    seconds forever, and a file is only yielded once its size and mtime are
+    the same in two consecutive polls, so files still being copied in are
+    not picked up. Call processed() once the predictions of a yielded file
+    have been received, to record it in the manifest, or failed() if it
+    cannot be decoded, so that it is not retried until it changes. Only audio files
+    (see discovery.is_audio) are considered, in subfolders too if recursive.
+    """
+    def __init__(self, folder, manifest, watch=False, interval=5.0,
+                 recursive=False, extensions=AUDIO_EXTENSIONS):
+        self.folder = folder
+        self.manifest = manifest
+        self.watch = watch
+        self.interval = interval
+        self.recursive = recursive
+        self.extensions = extensions
+        self._seen = {}
+        self._yielded = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _scan(self):
+        for entry in walk(self.folder, self.recursive):
+            # extensions are checked here, headers only once a file is stable
+            if is_audio(entry.path, self.extensions, sniff=False):
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+    def __iter__(self):
+        generation = self._generation
+        while not self._stop.is_set():
+            for path, size, mtime in self._scan():
+                if path in self._yielded:
+                    continue
+                recorded = self.manifest.get(path)
+                if recorded is not None and recorded[:2] == (size, mtime):
+                    continue
+                if self.watch and self._seen.get(path) != (size, mtime):
+                    # wait for the file to stop changing
+                    self._seen[path] = (size, mtime)
+                    continue
+                self._seen.pop(path, None)
+                if not is_audio(path, None):
+                    continue
+                content_hash = file_hash(path)
+                if recorded is not None and recorded[2] == content_hash:
+                    self.manifest.mark(path, size, mtime, content_hash, recorded[3])
+                    continue
+                with self._lock:
+                    if self._generation != generation:
+                        # requeued: a newer iterator takes over
+                        return
+                    self._yielded[path] = (size, mtime, content_hash)
+                yield path
+            if not self.watch:
+                return
+            self._stop.wait(self.interval)
+
+    def requeue(self):
+        """Forgets the yielded files that were not processed, so that the
+        next scan of a new iterator yields them again. Iterators created
+        before the requeue yield nothing more."""
+        with self._lock:
+            self._generation += 1
+            self._yielded.clear()
+
+    def processed(self, path):
+        if path in self._yielded:
+            self.manifest.mark(path, *self._yielded.pop(path))
+
+    def failed(self, path):
+        if path in self._yielded:
+            self.manifest.mark(path, *self._yielded.pop(path), status='failed')
+
+    def stop(self):
+        self._stop.set()